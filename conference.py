@@ -10,18 +10,32 @@ created by wesc on 2014 apr 21
 
 """
 
+from collections import Counter
+import csv
 from datetime import datetime
+from datetime import timedelta
+import hashlib
+import json
+import logging
+import operator
+from operator import attrgetter
+import random
+import time
 
 import endpoints
 from protorpc import messages
 from protorpc import message_types
+from protorpc import protojson
 from protorpc import remote
 
+from google.appengine.api import datastore_errors
 from google.appengine.api import memcache
 from google.appengine.api import taskqueue
 from google.appengine.ext import ndb
 
 from models import ConflictException
+from models import ImportChunk
+from models import ImportJob
 from models import Profile
 from models import ProfileMiniForm
 from models import ProfileForm
@@ -30,9 +44,18 @@ from models import BooleanMessage
 from models import Conference
 from models import ConferenceForm
 from models import ConferenceForms
+from models import ConferenceFieldsForm
 from models import ConferenceQueryForm
 from models import ConferenceQueryForms
+from models import ConferenceRegistrationForm
+from models import ConferenceRegistrationResult
+from models import ConferenceRegistrationResults
 from models import TeeShirtSize
+from models import UserEmail
+from models import SeatShard
+from models import Registration
+from models import WishlistEntry
+from models import Agenda
 from models import Session
 from models import SessionForm
 from models import SessionForms
@@ -41,7 +64,11 @@ from models import SessionsBySpeaker
 from models import AddSessionToWishlist
 from models import FindSessionByDatewithStartTimeRange
 from models import SessionsBySpeakerOnSpecificDate
+from models import SearchForm
+from models import SearchResult
+from models import SearchResults
 from models import Speaker
+from models import SpeakerStats
 from models import SpeakerForm
 from models import SpeakerForms
 
@@ -51,15 +78,60 @@ from settings import IOS_CLIENT_ID
 from settings import ANDROID_AUDIENCE
 
 from utils import getUserId
+import notify
+import search
+import unitofwork
 
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
 EMAIL_SCOPE = endpoints.EMAIL_SCOPE
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
-MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
+MEMCACHE_NEARLY_SOLD_OUT_KEY = "NEARLY_SOLD_OUT"
 MEMCACHE_FEATURED_SPEAKER_KEY = "FEATURED_SPEAKER"
+MEMCACHE_CONF_FEATURED_SPEAKER_KEY = "FEATURED_SPEAKER:%s"
 ANNOUNCEMENT_TPL = ('Last chance to attend! The following conferences '
                     'are nearly sold out: %s')
+NEARLY_SOLD_OUT_SEATS = 5
+MEMCACHE_CAS_RETRIES = 3
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+FANOUT_BATCH_SIZE = 100
+MEMCACHE_CONF_QUERY_KEY = "CONF_QUERY:%s"
+MEMCACHE_CONF_QUERY_GEN_KEY = "CONF_QUERY_GEN:%s"
+MEMCACHE_AGENDA_KEY = "AGENDA:%s"
+# larger agendas are read from the datastore; memcache values are
+# limited to 1MB
+MAX_CACHED_AGENDA_BYTES = 900 * 1024
+MEMCACHE_VERSION_KEY = "VERSION:%s"
+CONF_QUERY_CACHE_TIME = 600
+MAX_QUERY_SCAN = 1000
+# page token prefix of the second ('>') half of a split '!=' query
+UPPER_HALF_TOKEN = '1~'
+QUERY_SCAN_BATCH_SIZE = 100
+NUM_SEAT_SHARDS = 10
+# one entity group per seat shard plus the Profile's, within the xg limit
+MAX_BATCH_REGISTRATIONS = 24
+BACKFILL_BATCH_SIZE = 100
+# legacy list entries moved per transaction, within the mutation limit
+BACKFILL_MOVE_BATCH_SIZE = 400
+IMPORT_BATCH_SIZE = 500
+IMPORT_PUT_CHUNK = 500
+# imported sessions per transaction: each writes its search document
+# too, within the mutation limit
+IMPORT_SESSION_TXN_SIZE = 200
+# stored chunks stay well below the 1MB entity limit
+IMPORT_CHUNK_BYTES = 512 * 1024
+IMPORT_MAX_ERRORS = 1000
+IMPORT_LIST_FIELDS = ('topics', 'typeOfSession')
+IMPORT_LIST_SEPARATOR = '|'
+
+# indexed, single valued Conference properties projection queries can read
+PROJECTABLE_FIELDS = ('name', 'description', 'organizerUserId', 'city',
+                      'startDate', 'month', 'endDate', 'maxAttendees',
+                      'seatsAvailable')
+SEAT_AGGREGATION_DELAY = 5
+FEATURED_SPEAKER_DELAY = 10
+AGENDA_REBUILD_DELAY = 5
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 DEFAULTS = {
@@ -78,6 +150,16 @@ OPERATORS = {
             'NE':   '!='
             }
 
+# in-memory versions of OPERATORS for filters the datastore can't apply
+FILTER_FUNCTIONS = {
+            '=':  operator.eq,
+            '>':  operator.gt,
+            '>=': operator.ge,
+            '<':  operator.lt,
+            '<=': operator.le,
+            '!=': operator.ne
+            }
+
 FIELDS = {
          'CITY': 'city',
          'TOPIC': 'topics',
@@ -95,6 +177,79 @@ CONF_POST_REQUEST = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1),
 )
 
+FEATURED_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+)
+
+SESSION_PAGE_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    pageSize=messages.IntegerField(1),
+    pageToken=messages.StringField(2),
+)
+
+CONF_SESSION_PAGE_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1, required=True),
+    pageSize=messages.IntegerField(2),
+    pageToken=messages.StringField(3),
+)
+
+SPEAKER_POST_REQUEST = endpoints.ResourceContainer(
+    SpeakerForm,
+    websafeSpeakerKey=messages.StringField(1),
+)
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def _formPlan(model, form, converters=None, computed=None, skip=()):
+    """Return the plan for copying model entities into form messages: a
+    list of (field name, getter) so each row is copied with plain
+    attribute access.
+
+    converters maps a property name to a function applied to its value;
+    computed maps a field name to a function of the entity.
+    """
+    converters = converters or {}
+    computed = computed or {}
+    plan = []
+    for field in form.all_fields():
+        name = field.name
+        if name in skip:
+            continue
+        if name in computed:
+            plan.append((name, computed[name]))
+        elif name in model._properties:
+            getter = attrgetter(name)
+            if name in converters:
+                getter = (lambda entity, get=getter,
+                          convert=converters[name]: convert(get(entity)))
+            plan.append((name, getter))
+    return plan
+
+
+# field copy plans, built once; see ConferenceApi._applyFormPlan()
+CONFERENCE_FORM_PLAN = _formPlan(
+    Conference, ConferenceForm,
+    converters={'startDate': str, 'endDate': str},
+    computed={'websafeKey': lambda conf: conf.key.urlsafe()})
+
+PROFILE_FORM_PLAN = _formPlan(
+    Profile, ProfileForm,
+    converters={'teeShirtSize': lambda size: getattr(TeeShirtSize, size)},
+    skip=('conferenceKeysToAttend', 'sessionKeysToAttend'))
+
+SESSION_FORM_PLAN = _formPlan(
+    Session, SessionForm,
+    converters={'date': str,
+                'startTime': lambda t: str(t.strftime("%H:%M"))},
+    computed={'sessionWebSafeKey': lambda sess: sess.key.urlsafe()})
+
+SPEAKER_FORM_PLAN = _formPlan(
+    Speaker, SpeakerForm,
+    computed={'speakerWebSafeKey': lambda speak: speak.key.urlsafe()})
+
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 
@@ -107,41 +262,96 @@ class ConferenceApi(remote.Service):
 
 # - - - Conference objects - - - - - - - - - - - - - - - - -
 
-    def _copyConferenceToForm(self, conf, displayName):
-        """Copy relevant fields from Conference to ConferenceForm."""
-        cf = ConferenceForm()
-        for field in cf.all_fields():
-            if hasattr(conf, field.name):
-                # convert Date to date string; just copy others
-                if field.name.endswith('Date'):
-                    setattr(cf, field.name, str(getattr(conf, field.name)))
-                else:
-                    setattr(cf, field.name, getattr(conf, field.name))
-            elif field.name == "websafeKey":
-                setattr(cf, field.name, conf.key.urlsafe())
-        if displayName:
-            setattr(cf, 'organizerDisplayName', displayName)
-        cf.check_initialized()
-        return cf
+    @staticmethod
+    def _applyFormPlan(plan, form, entity):
+        """Copy entity into a new form message following plan. The
+        message is validated once as a whole when the response is
+        encoded, so rows are not checked one by one here."""
+        msg = form()
+        for name, getter in plan:
+            setattr(msg, name, getter(entity))
+        return msg
+
+    def _copyConferenceToForm(self, conf, fields=None):
+        """Copy relevant fields from Conference to ConferenceForm, only
+        those in fields if given."""
+        # convert Date to date string; just copy others
+        plan = CONFERENCE_FORM_PLAN
+        if fields is not None:
+            plan = [(name, getter) for name, getter in plan
+                    if name in fields]
+        return self._applyFormPlan(plan, ConferenceForm, conf)
+
+    def _copyConferencesToForms(self, confs, fields=None):
+        """Copy Conferences to ConferenceForms, only fields if given.
+        Conferences not yet backfilled with their organizer's name (see
+        _backfillOrganizerNames()) read it off the Profiles, fetched
+        with one get_multi for the whole list."""
+        confs = [conf for conf in confs if conf]
+        forms = [self._copyConferenceToForm(conf, fields) for conf in confs]
+        if fields is None or 'organizerDisplayName' in fields:
+            unnamed = [(conf, cf) for conf, cf in zip(confs, forms)
+                       if cf.organizerDisplayName is None]
+            p_keys = list(set(conf.key.parent() for conf, cf in unnamed))
+            names = dict((prof.key, prof.displayName or '')
+                         for prof in ndb.get_multi(p_keys) if prof)
+            for conf, cf in unnamed:
+                cf.organizerDisplayName = names.get(conf.key.parent(), '')
+        return forms
 
-    def _createConferenceObject(self, request):
-        """Create or update Conference object,
-        returning ConferenceForm/request."""
-        # preload necessary data items
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
+    @staticmethod
+    def _sparseFields(fields):
+        """Check a requested ConferenceForm fieldset; None for all."""
+        if not fields:
+            return None
+        valid = [field.name for field in ConferenceForm.all_fields()
+                 if field.name not in ('etag', 'notModified')]
+        for name in fields:
+            if name not in valid:
+                raise endpoints.BadRequestException(
+                    "Unknown field: %s" % name)
+        return set(fields)
 
-        if not request.name:
-            raise endpoints.BadRequestException(
-                "Conference 'name' field required")
+    @staticmethod
+    def _conferenceProjection(fields, filters):
+        """Return the Conference properties a projection query has to
+        read to fill fields, or None if it takes a full fetch. Fields
+        filtered by equality can't be projected; their values are known
+        from the filters instead (see _fillFilteredFields()).
+        """
+        if not fields:
+            return None
+        equalities = set(f["field"] for f in filters if f["operator"] == "=")
+        projection = []
+        for name in sorted(fields):
+            if name == 'websafeKey':
+                continue
+            if name not in PROJECTABLE_FIELDS:
+                return None
+            if name not in equalities:
+                projection.append(name)
+        return projection or None
+
+    @staticmethod
+    def _fillFilteredFields(forms, fields, filters):
+        """Set requested fields filtered by equality on forms built from
+        projection query results."""
+        for f in filters:
+            if f["operator"] == "=" and f["field"] in fields:
+                for cf in forms:
+                    setattr(cf, f["field"], f["value"])
 
+    @staticmethod
+    def _conferenceData(request):
+        """Convert ConferenceForm into Conference property values,
+        filling in defaults on both."""
         # copy ConferenceForm/ProtoRPC Message into dict
         data = {field.name: getattr(request, field.name)
                 for field in request.all_fields()}
         del data['websafeKey']
         del data['organizerDisplayName']
+        del data['etag']
+        del data['notModified']
 
         # add default values for those missing
         # (both data model & outbound Message)
@@ -165,6 +375,23 @@ class ConferenceApi(remote.Service):
         # set seatsAvailable to be same as maxAttendees on creation
         if data["maxAttendees"] > 0:
             data["seatsAvailable"] = data["maxAttendees"]
+        return data
+
+    def _createConferenceObject(self, request):
+        """Create or update Conference object,
+        returning ConferenceForm/request."""
+        # preload necessary data items
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        user_id = getUserId(user)
+
+        if not request.name:
+            raise endpoints.BadRequestException(
+                "Conference 'name' field required")
+
+        data = self._conferenceData(request)
+
         # generate Profile Key based on user ID and Conference
         # ID based on Profile key get Conference key from ID
         p_key = ndb.Key(Profile, user_id)
@@ -173,16 +400,37 @@ class ConferenceApi(remote.Service):
         data['key'] = c_key
         data['organizerUserId'] = request.organizerUserId = user_id
 
+        # store organizer's display name on the Conference so reads
+        # don't need to fetch the Profile; kept current by saveProfile()
+        prof = p_key.get()
+        data['organizerDisplayName'] = request.organizerDisplayName = \
+            getattr(prof, 'displayName', None) or ''
+
         # create Conference, send email to organizer confirming
         # creation of Conference & return (modified) ConferenceForm
-        Conference(**data).put()
-        taskqueue.add(params={'email': user.email(),
-                      'conferenceInfo': repr(request)},
-                      url='/tasks/send_confirmation_email')
-
+        conf = Conference(**data)
+        shards = [SeatShard(key=k, seats=n) for k, n in zip(
+            self._seatShardKeys(c_key),
+            self._splitSeats(data['seatsAvailable']))]
+        for entity in [conf, search.documentFor(conf)] + shards:
+            unitofwork.put(entity)
+
+        def _created():
+            self._invalidateQueryCache(self._conferenceGenerationKeys(conf))
+            if self._nearlySoldOut(conf.seatsAvailable):
+                self._updateAnnouncement(c_key.urlsafe(), conf.name,
+                                         conf.seatsAvailable)
+            # sent with the organizer's other notifications as a digest
+            notify.notify(user.email(), 'conferenceCreated', {
+                'name': conf.name,
+                'city': conf.city,
+                'startDate': str(conf.startDate or 'TBD'),
+                'endDate': str(conf.endDate or 'TBD')})
+
+        unitofwork.afterFlush(_created)
         return request
 
-    @ndb.transactional()
+    @ndb.transactional(xg=True)
     def _updateConferenceObject(self, request):
         user = endpoints.get_current_user()
         if not user:
@@ -209,9 +457,22 @@ class ConferenceApi(remote.Service):
             raise endpoints.ForbiddenException(
                 'Only the owner can update the conference.')
 
+        # expire cached queries the old and new versions could match,
+        # once the transaction has committed
+        gen_keys = self._conferenceGenerationKeys(conf)
+
         # Not getting all the fields, so don't create a new object; just
         # copy relevant fields from ConferenceForm to Conference object
+        oldMaxAttendees = conf.maxAttendees or 0
+        oldSeats = conf.seatsAvailable
+        oldName = conf.name
+        oldDoc = search.documentFor(conf)
         for field in request.all_fields():
+            # organizer display name is maintained by saveProfile();
+            # seatsAvailable is aggregated from the seat shards
+            if field.name in ('organizerDisplayName', 'seatsAvailable',
+                              'etag', 'notModified'):
+                continue
             data = getattr(request, field.name)
             # only copy fields where we get data
             if data not in (None, []):
@@ -222,12 +483,35 @@ class ConferenceApi(remote.Service):
                         conf.month = data.month
                 # write to Conference object
                 setattr(conf, field.name, data)
+
+        # hand out or take back the seats a capacity change implies
+        if (conf.maxAttendees or 0) != oldMaxAttendees:
+            self._resizeSeatShards(
+                conf, (conf.maxAttendees or 0) - oldMaxAttendees)
         conf.put()
-        prof = ndb.Key(Profile, user_id).get()
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        # reindex only if the searchable text changed
+        doc = search.documentFor(conf)
+        if doc != oldDoc:
+            doc.put()
+        gen_keys.extend(self._conferenceGenerationKeys(conf))
+        ndb.get_context().call_on_commit(
+            lambda: self._invalidateQueryCache(set(gen_keys)))
+        ndb.get_context().call_on_commit(
+            lambda: self._bumpVersions(conf.key))
+
+        # a capacity edit can move it across the nearly sold out
+        # threshold; a rename changes how it is announced
+        nearly_sold_out = self._nearlySoldOut(conf.seatsAvailable)
+        if nearly_sold_out != self._nearlySoldOut(oldSeats) or \
+                (nearly_sold_out and conf.name != oldName):
+            ndb.get_context().call_on_commit(
+                lambda: self._updateAnnouncement(
+                    conf.key.urlsafe(), conf.name, conf.seatsAvailable))
+        return self._copyConferencesToForms([conf])[0]
 
     @endpoints.method(ConferenceForm, ConferenceForm, path='conference',
                       http_method='POST', name='createConference')
+    @unitofwork.perRequest
     def createConference(self, request):
         """Create new conference."""
         return self._createConferenceObject(request)
@@ -244,21 +528,32 @@ class ConferenceApi(remote.Service):
                       http_method='GET', name='getConference')
     def getConference(self, request):
         """Return requested conference (by websafeConferenceKey)."""
-        # get Conference object from request; bail if not found
         try:
-            conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+            c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
         except:
-            conf = None
+            c_key = None
+        if not c_key or c_key.kind() != Conference._get_kind():
+            raise endpoints.NotFoundException(
+                'No conference found for key: %s' \
+                % request.websafeConferenceKey)
 
+        # polling clients that have the current version get nothing else
+        etag = self._etag('c', c_key)
+        if self._notModified(etag):
+            return ConferenceForm(etag=etag, notModified=True)
+
+        # get Conference object from request; bail if not found
+        conf = c_key.get()
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found for key: %s' \
                 % request.websafeConferenceKey)
-        prof = conf.key.parent().get()
         # return ConferenceForm
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        cf = self._copyConferencesToForms([conf])[0]
+        cf.etag = etag
+        return cf
 
-    @endpoints.method(message_types.VoidMessage, ConferenceForms,
+    @endpoints.method(ConferenceFieldsForm, ConferenceForms,
                       path='getConferencesCreated',
                       http_method='POST', name='getConferencesCreated')
     def getConferencesCreated(self, request):
@@ -268,19 +563,20 @@ class ConferenceApi(remote.Service):
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
         user_id = getUserId(user)
+        fields = self._sparseFields(request.fields)
+
+        # create ancestor query for all key matches for this user; an
+        # ancestor projection would need a composite index per fieldset,
+        # so only the response is trimmed to the requested fields
+        confs = Conference.query(ancestor=ndb.Key(Profile, user_id)).fetch()
 
-        # create ancestor query for all key matches for this user
-        confs = Conference.query(ancestor=ndb.Key(Profile, user_id))
-        prof = ndb.Key(Profile, user_id).get()
         # return set of ConferenceForm objects per Conference
         return ConferenceForms(
-            items=[self._copyConferenceToForm(
-                conf, getattr(prof, 'displayName')) for conf in confs])
+            items=self._copyConferencesToForms(confs, fields))
 
-    def _getQuery(self, request):
+    def _getQuery(self, inequality_filter, filters):
         """Return formatted query from the submitted filters."""
         q = Conference.query()
-        inequality_filter, filters = self._formatFilters(request.filters)
 
         # If exists, sort on inequality filter first
         if not inequality_filter:
@@ -290,8 +586,6 @@ class ConferenceApi(remote.Service):
             q = q.order(Conference.name)
 
         for filtr in filters:
-            if filtr["field"] in ["month", "maxAttendees"]:
-                filtr["value"] = int(filtr["value"])
             formatted_query = ndb.query.FilterNode(
                 filtr["field"], filtr["operator"], filtr["value"])
             q = q.filter(formatted_query)
@@ -300,7 +594,6 @@ class ConferenceApi(remote.Service):
     def _formatFilters(self, filters):
         """Parse, check validity and format user supplied filters."""
         formatted_filters = []
-        inequality_field = None
 
         for f in filters:
             filtr = {field.name: getattr(f, field.name)
@@ -313,64 +606,543 @@ class ConferenceApi(remote.Service):
                 raise endpoints.BadRequestException(
                     "Filter contains invalid field or operator.")
 
-            # Every operation except "=" is an inequality
-            if filtr["operator"] != "=":
-                # check if inequality operation has been used in previous
-                # filters disallow the filter if inequality was performed
-                # on a different field before track the field on which the
-                # inequality operation is performed
-                if inequality_field and inequality_field != filtr["field"]:
+            if filtr["field"] in ["month", "maxAttendees"]:
+                try:
+                    filtr["value"] = int(filtr["value"])
+                except (TypeError, ValueError):
                     raise endpoints.BadRequestException(
-                        "Inequality filter is allowed on only one field.")
-                else:
-                    inequality_field = filtr["field"]
+                        "Filter on %s requires an integer value."
+                        % filtr["field"])
 
             formatted_filters.append(filtr)
-        return (inequality_field, formatted_filters)
+        return formatted_filters
+
+    def _planQuery(self, filters, inequality_field=None):
+        """Split filters into those the datastore runs and those checked
+        in memory; returns (inequality field, pushed filters, residual
+        filters, estimates).
+
+        The datastore allows inequalities on only one field. When the
+        filters have more, the matches of each candidate field (with
+        the equality filters) are counted concurrently, up to
+        MAX_QUERY_SCAN, and the most selective one is pushed. Pass
+        inequality_field to reuse the field chosen for an earlier page.
+        """
+        fields = []
+        for f in filters:
+            # Every operation except "=" is an inequality
+            if f["operator"] != "=" and f["field"] not in fields:
+                fields.append(f["field"])
+        if inequality_field and inequality_field not in fields:
+            raise endpoints.BadRequestException(
+                "pageToken doesn't belong to these filters.")
+
+        estimates = {}
+        if len(fields) > 1 and not inequality_field:
+            equalities = [f for f in filters if f["operator"] == "="]
+            counts = dict((field, self._getQuery(field, equalities + [
+                f for f in filters
+                if f["field"] == field and f["operator"] != "="
+            ]).count_async(limit=MAX_QUERY_SCAN)) for field in fields)
+            estimates = dict((field, count.get_result())
+                             for field, count in counts.items())
+            inequality_field = min(fields, key=lambda field: estimates[field])
+        elif fields and not inequality_field:
+            inequality_field = fields[0]
+
+        pushed = [f for f in filters
+                  if f["operator"] == "=" or f["field"] == inequality_field]
+        residual = [f for f in filters
+                    if f["operator"] != "=" and f["field"] != inequality_field]
+        return inequality_field, pushed, residual, estimates
+
+    @staticmethod
+    def _splitNotEqual(pushed, residual):
+        """Return the (pushed, residual) filters of each query a plan is
+        run as, in order. ndb runs a '!=' filter as several queries
+        merged together, which can't be paged with cursors; instead the
+        first '!=' on the pushed field is run as a '<' query and then a
+        '>' query, and any others are checked in memory. A list property
+        can match both halves, so the second half leaves out what the
+        first returned.
+        """
+        not_equal = [f for f in pushed if f["operator"] == "!="]
+        if not not_equal:
+            return [(pushed, residual)]
+        split = not_equal[0]
+        pushed = [f for f in pushed if f["operator"] != "!="]
+        residual = residual + not_equal[1:]
+        upper_residual = list(residual)
+        if Conference._properties[split["field"]]._repeated:
+            upper_residual.append(dict(split, operator="<", exclude=True))
+        return [(pushed + [dict(split, operator="<")], residual),
+                (pushed + [dict(split, operator=">")], upper_residual)]
+
+    @staticmethod
+    def _matchesFilter(conf, filtr):
+        """Check a Conference against one filter in memory the way the
+        datastore would: a list property matches if any value does and
+        a missing value never matches. An 'exclude' filter matches when
+        no value does."""
+        compare = FILTER_FUNCTIONS[filtr["operator"]]
+        values = getattr(conf, filtr["field"])
+        if not isinstance(values, list):
+            values = [values]
+        matched = any(value is not None and compare(value, filtr["value"])
+                      for value in values)
+        return not matched if filtr.get("exclude") else matched
+
+    def _scanConferences(self, q, residual, page_size, cursor):
+        """Stream q, keeping Conferences that pass the residual filters,
+        until page_size match or MAX_QUERY_SCAN have been read; returns
+        (conferences, next cursor or None, number scanned)."""
+        it = q.iter(start_cursor=cursor, produce_cursors=True,
+                    batch_size=QUERY_SCAN_BATCH_SIZE)
+        matched = []
+        scanned = 0
+        more = False
+        for conf in it:
+            scanned += 1
+            if all(self._matchesFilter(conf, f) for f in residual):
+                matched.append(conf)
+            if len(matched) >= page_size or scanned >= MAX_QUERY_SCAN:
+                more = it.probably_has_next()
+                break
+        return matched, (it.cursor_after() if more else None), scanned
+
+    @staticmethod
+    def _explainQueryPlan(inequality_field, pushed, residual, estimates,
+                          scanned):
+        """Describe how a conference query was run."""
+        def describe(filters):
+            return ', '.join('%s%s %s %s' % ('not ' if f.get("exclude")
+                                             else '', f["field"],
+                                             f["operator"], f["value"])
+                             for f in filters) or 'none'
+
+        order = ([inequality_field] if inequality_field else []) + ['name']
+        parts = ['datastore: %s (order by %s)' % (describe(pushed),
+                                                  ', '.join(order))]
+        if estimates:
+            parts.append('estimated matches: %s' % ', '.join(
+                '%s %s%d' % (field,
+                             '>=' if count >= MAX_QUERY_SCAN else '',
+                             count)
+                for field, count in sorted(estimates.items())))
+        parts.append('in memory: %s' % describe(residual))
+        parts.append('scanned %d (limit %d)' % (scanned, MAX_QUERY_SCAN))
+        return '; '.join(parts)
+
+    @staticmethod
+    def _queryGenerationKey(name):
+        """Return memcache key of the query cache generation for name."""
+        if isinstance(name, unicode):
+            name = name.encode('utf-8')
+        return MEMCACHE_CONF_QUERY_GEN_KEY % hashlib.sha1(name).hexdigest()
+
+    @staticmethod
+    def _filterGenerationKeys(filters):
+        """Return generation keys a cached filter query depends on.
+
+        A conference can only match when it has every equality value,
+        so those generations suffice; otherwise depend on the fields
+        compared by inequality, or on every conference ('*').
+        """
+        names = ['%s=%s' % (f["field"], f["value"]) for f in filters
+                 if f["operator"] == "="]
+        if not names:
+            names = [f["field"] for f in filters] or ['*']
+        return sorted(set(ConferenceApi._queryGenerationKey(name)
+                          for name in names))
+
+    @staticmethod
+    def _conferenceGenerationKeys(*confs):
+        """Return generation keys affected by writing the given
+        Conference versions (pass both old and new values on update).
+        """
+        names = set(['*'])
+        for conf in confs:
+            if not conf:
+                continue
+            for field in FIELDS.values():
+                names.add(field)
+                values = getattr(conf, field)
+                if not isinstance(values, list):
+                    values = [values]
+                for value in values:
+                    names.add('%s=%s' % (field, value))
+        return [ConferenceApi._queryGenerationKey(name) for name in names]
+
+    @staticmethod
+    def _getQueryGenerations(gen_keys, gens=None):
+        """Return current generation numbers for gen_keys, seeding any
+        that are missing; None entries mean memcache is unavailable.
+        gens may hold values already read with memcache.get_multi().
+        """
+        if gens is None:
+            gens = memcache.get_multi(gen_keys)
+        missing = [k for k in gen_keys if k not in gens]
+        if missing:
+            # seed from the clock so an evicted generation never comes
+            # back with a value an old cache entry was stored under
+            seed = int(time.time() * 1000)
+            memcache.add_multi(dict((k, seed) for k in missing))
+            gens.update(memcache.get_multi(missing))
+        return [gens.get(k) for k in gen_keys]
+
+    @staticmethod
+    def _invalidateQueryCache(gen_keys):
+        """Bump generations so cached query pages built on them expire."""
+        memcache.offset_multi(dict((k, 1) for k in gen_keys),
+                              initial_value=int(time.time() * 1000))
 
     @endpoints.method(ConferenceQueryForms, ConferenceForms,
                       path='queryConferences',
                       http_method='POST',
                       name='queryConferences')
     def queryConferences(self, request):
-        """Query for conferences."""
-        conferences = self._getQuery(request)
+        """Query for conferences, one page at a time."""
+        page_size = request.pageSize or DEFAULT_PAGE_SIZE
+        if page_size < 1 or page_size > MAX_PAGE_SIZE:
+            raise endpoints.BadRequestException(
+                "pageSize must be between 1 and %d." % MAX_PAGE_SIZE)
+
+        filters = self._formatFilters(request.filters)
+        fields = self._sparseFields(request.fields)
+
+        # pages of a query planned in memory carry the pushed field
+        # ahead of the cursor so later pages keep the same plan
+        plan_field, token = None, request.pageToken
+        if token and '.' in token:
+            plan_field, token = token.split('.', 1)
+
+        # cached pages are keyed by the canonical filters and page and
+        # are only valid while their generations are unchanged; read
+        # the generations before querying so a concurrent write wins
+        canonical = repr((sorted((f["field"], f["operator"], f["value"])
+                                 for f in filters),
+                          page_size, request.pageToken,
+                          sorted(fields or [])))
+        cache_key = MEMCACHE_CONF_QUERY_KEY % hashlib.sha1(
+            canonical.encode('utf-8')).hexdigest()
+        gen_keys = self._filterGenerationKeys(filters)
+        found = memcache.get_multi([cache_key] + gen_keys)
+        cached = found.pop(cache_key, None)
+        gens = self._getQueryGenerations(gen_keys, found)
+
+        projection = None
+        if cached and None not in gens and cached['gens'] == gens:
+            conf_keys = cached['keys']
+            conferences = [None] * len(conf_keys)
+            projection = cached.get('projection')
+            if projection:
+                conferences = [Conference(key=key, **values)
+                               for key, values in zip(conf_keys,
+                                                      cached['rows'])]
+            next_token = cached['next']
+            explain = 'cached page; %s' % cached['explain']
+        else:
+            # the second half of a split '!=' query is marked in the token
+            half = 0
+            if token and token.startswith(UPPER_HALF_TOKEN):
+                half, token = 1, token[len(UPPER_HALF_TOKEN):]
+
+            # resume from the cursor handed out with the previous page
+            cursor = None
+            if token:
+                try:
+                    cursor = ndb.Cursor(urlsafe=token)
+                except:
+                    raise endpoints.BadRequestException(
+                        "Invalid pageToken: %s" % request.pageToken)
 
-        # need to fetch organiser displayName from profiles
-        # get all keys and use get_multi for speed
-        organisers = [(ndb.Key(Profile, conf.organizerUserId))
-                      for conf in conferences]
-        profiles = ndb.get_multi(organisers)
+            inequality_field, pushed, residual, estimates = \
+                self._planQuery(filters, plan_field)
+            runs = self._splitNotEqual(pushed, residual)
+            if half >= len(runs):
+                raise endpoints.BadRequestException(
+                    "pageToken doesn't belong to these filters.")
+            # read only the requested fields when an index allows it
+            projection = self._conferenceProjection(fields, pushed)
+
+            # conferences has None where only the key has been read
+            conferences, conf_keys = [], []
+            scanned = 0
+            projected = False
+            next_token = None
+            for half in range(half, len(runs)):
+                run_pushed, run_residual = runs[half]
+                q = self._getQuery(inequality_field, run_pushed)
+                wanted = page_size - len(conf_keys)
+                if run_residual:
+                    # filter the rest in memory while streaming the query
+                    found, next_cursor, n = self._scanConferences(
+                        q, run_residual, wanted, cursor)
+                    more = next_cursor is not None
+                    keys = [conf.key for conf in found]
+                else:
+                    # the projection or the page's keys, either way in a
+                    # single pass, the query is not run again
+                    found = None
+                    if projection:
+                        try:
+                            found, next_cursor, more = q.fetch_page(
+                                wanted, start_cursor=cursor,
+                                projection=projection)
+                            keys = [conf.key for conf in found]
+                            projected = True
+                        except (datastore_errors.NeedIndexError,
+                                datastore_errors.BadRequestError):
+                            projection = None
+                    if found is None:
+                        keys, next_cursor, more = q.fetch_page(
+                            wanted, start_cursor=cursor, keys_only=True)
+                        found = [None] * len(keys)
+                    n = len(keys)
+                conferences.extend(found)
+                conf_keys.extend(keys)
+                scanned += n
+                cursor = None
+
+                if more and next_cursor:
+                    next_token = ((UPPER_HALF_TOKEN if half else '') +
+                                  next_cursor.urlsafe())
+                    break
+                if len(conf_keys) >= page_size:
+                    if half + 1 < len(runs):
+                        next_token = UPPER_HALF_TOKEN
+                    break
+            # pages of a plan made in memory carry the pushed field
+            if next_token and residual:
+                next_token = inequality_field + '.' + next_token
+            if any(conf is None for conf in conferences):
+                projection = None
+
+            explain = self._explainQueryPlan(
+                inequality_field, pushed, residual, estimates, scanned)
+            if len(runs) > 1:
+                explain += "; '!=' run as '<' then '>'"
+            if projected and projection:
+                explain += '; projection: %s' % ', '.join(projection)
+            elif fields:
+                explain += '; full fetch for the requested fields'
+
+            if None not in gens:
+                memcache.set(cache_key, {'gens': gens,
+                                         'keys': conf_keys,
+                                         'projection': projection,
+                                         'rows': [
+                                             dict((name, getattr(conf, name))
+                                                  for name in projection)
+                                             for conf in conferences]
+                                         if projection else None,
+                                         'next': next_token,
+                                         'explain': explain},
+                             time=CONF_QUERY_CACHE_TIME)
+
+        # fetch the conferences only the keys of which have been read
+        missing = [key for key, conf in zip(conf_keys, conferences)
+                   if conf is None]
+        if missing:
+            fetched = iter(ndb.get_multi(missing))
+            conferences = [next(fetched) if conf is None else conf
+                           for conf in conferences]
+
+        # return individual ConferenceForm object per Conference; fields
+        # filtered by equality weren't projected, they are filled in
+        # from the filters
+        copy_fields = fields
+        if projection:
+            copy_fields = fields - set(f["field"] for f in filters
+                                       if f["operator"] == "=")
+        items = self._copyConferencesToForms(conferences, copy_fields)
+        if projection:
+            self._fillFilteredFields(items, fields, filters)
+        return ConferenceForms(
+                items=items,
+                nextPageToken=next_token,
+                explain=explain if request.explain else None)
 
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
 
-        # return individual ConferenceForm object per Conference
-        return ConferenceForms(
-                items=[self._copyConferenceToForm(
-                      conf, names[conf.organizerUserId]) for conf in
-                      conferences])
+# - - - Version stamps - - - - - - - - - - - - - - - - - - -
+
+    @staticmethod
+    def _versionStamp(key):
+        """Return the version stamp of a Conference or Profile from
+        memcache; seeded from the clock when missing, so a stamp lost
+        from memcache never comes back with an old value.
+        """
+        cache_key = MEMCACHE_VERSION_KEY % key.urlsafe()
+        stamp = memcache.get(cache_key)
+        if stamp is None:
+            stamp = int(time.time() * 1000000)
+            if not memcache.add(cache_key, stamp):
+                stamp = memcache.get(cache_key) or stamp
+        return stamp
+
+    @staticmethod
+    def _bumpVersions(*keys):
+        """Move on the version stamps of Conferences or Profiles whose
+        responses changed; call once the change is committed."""
+        seed = int(time.time() * 1000000)
+        for key in keys:
+            cache_key = MEMCACHE_VERSION_KEY % key.urlsafe()
+            if memcache.incr(cache_key, initial_value=seed) is None:
+                memcache.delete(cache_key)
+
+    def _etag(self, prefix, key):
+        """Return the ETag of a response built from key's version."""
+        return '"%s%d"' % (prefix, self._versionStamp(key))
+
+    def _notModified(self, etag):
+        """Whether the request's If-None-Match header names etag."""
+        header = self.request_state.headers.get('If-None-Match') or ''
+        tags = [tag.strip() for tag in header.split(',')]
+        return etag in tags or 'W/' + etag in tags
 
 
 # - - - Profile objects - - - - - - - - - - - - - - - - - - -
 
-    def _copyProfileToForm(self, prof):
+    def _copyProfileToForm(self, prof, conferenceKeys, sessionKeys):
         """Copy relevant fields from Profile to ProfileForm."""
-        # copy relevant fields from Profile to ProfileForm
-        pf = ProfileForm()
-        for field in pf.all_fields():
-            if hasattr(prof, field.name):
-                # convert t-shirt string to Enum; just copy others
-                if field.name == 'teeShirtSize':
-                    setattr(pf, field.name, getattr(
-                            TeeShirtSize, getattr(prof, field.name)))
-                else:
-                    setattr(pf, field.name, getattr(prof, field.name))
-        pf.check_initialized()
+        # convert t-shirt string to Enum; just copy others
+        pf = self._applyFormPlan(PROFILE_FORM_PLAN, ProfileForm, prof)
+        # registrations and wishlist are kept in their own entities
+        pf.conferenceKeysToAttend = [k.urlsafe() for k in conferenceKeys]
+        pf.sessionKeysToAttend = [k.urlsafe() for k in sessionKeys]
         return pf
 
+    @staticmethod
+    def _registeredConferenceKeysAsync(p_key):
+        """Return future for the keys of Conferences the Profile is
+        registered for, in registration order (keys-only query).
+        """
+        @ndb.tasklet
+        def _keys():
+            reg_keys = yield Registration.query(ancestor=p_key).order(
+                Registration.created).fetch_async(keys_only=True)
+            raise ndb.Return([ndb.Key(urlsafe=k.id()) for k in reg_keys])
+        return _keys()
+
+    @staticmethod
+    def _wishlistSessionKeysAsync(p_key):
+        """Return future for the keys of Sessions on the Profile's
+        wishlist, in the order they were added (keys-only query).
+        """
+        @ndb.tasklet
+        def _keys():
+            entry_keys = yield WishlistEntry.query(ancestor=p_key).order(
+                WishlistEntry.created).fetch_async(keys_only=True)
+            raise ndb.Return([ndb.Key(urlsafe=k.id()) for k in entry_keys])
+        return _keys()
+
+    @staticmethod
+    def _legacyKey(wsk, p_key):
+        """Parse a websafe key from a Profile's legacy lists; None, and
+        logged, if it doesn't parse."""
+        try:
+            return ndb.Key(urlsafe=wsk)
+        except:
+            logging.warning('skipping bad legacy key %r of profile %s',
+                            wsk, p_key.id())
+            return None
+
+    @staticmethod
+    @ndb.transactional()
+    def _backfillProfileBatch(p_key):
+        """Move up to BACKFILL_MOVE_BATCH_SIZE entries of a Profile's
+        legacy lists into Registration and WishlistEntry entities, in
+        order; returns the Profile.
+        """
+        prof = p_key.get()
+        if not prof or not (prof.conferenceKeysToAttend or
+                            prof.sessionKeysToAttend):
+            return prof
+
+        # later batches are created later, so the order is kept
+        created = datetime.utcnow()
+        wscks = prof.conferenceKeysToAttend[:BACKFILL_MOVE_BATCH_SIZE]
+        wssks = prof.sessionKeysToAttend[
+            :BACKFILL_MOVE_BATCH_SIZE - len(wscks)]
+        entities = []
+        for i, wsck in enumerate(wscks):
+            c_key = ConferenceApi._legacyKey(wsck, p_key)
+            if c_key:
+                entities.append(Registration(
+                    id=c_key.urlsafe(), parent=p_key, conference=c_key,
+                    created=created + timedelta(microseconds=i)))
+        for i, wssk in enumerate(wssks):
+            s_key = ConferenceApi._legacyKey(wssk, p_key)
+            if s_key:
+                entities.append(WishlistEntry(
+                    id=s_key.urlsafe(), parent=p_key, session=s_key,
+                    created=created + timedelta(microseconds=i)))
+        prof.conferenceKeysToAttend = \
+            prof.conferenceKeysToAttend[len(wscks):]
+        prof.sessionKeysToAttend = prof.sessionKeysToAttend[len(wssks):]
+        ndb.put_multi(entities + [prof])
+        return prof
+
+    @staticmethod
+    def _backfillProfile(p_key):
+        """Move a Profile's legacy conferenceKeysToAttend and
+        sessionKeysToAttend lists into Registration and WishlistEntry
+        entities, keeping their order, one transaction per batch of
+        entries; returns the Profile.
+        """
+        prof = ConferenceApi._backfillProfileBatch(p_key)
+        while prof and (prof.conferenceKeysToAttend or
+                        prof.sessionKeysToAttend):
+            prof = ConferenceApi._backfillProfileBatch(p_key)
+        return prof
+
+    @staticmethod
+    def _backfillProfiles(cursor=None):
+        """Backfill one page of Profiles, then chain a task for the
+        next page; used by backfill profiles task.
+        """
+        if cursor:
+            cursor = ndb.Cursor(urlsafe=cursor)
+        profiles, next_cursor, more = Profile.query().fetch_page(
+            BACKFILL_BATCH_SIZE, start_cursor=cursor)
+        for prof in profiles:
+            if prof.conferenceKeysToAttend or prof.sessionKeysToAttend:
+                ConferenceApi._backfillProfile(prof.key)
+
+        # map the emails of Profiles made before UserEmail existed
+        mappings = [UserEmail(key=ndb.Key(UserEmail, prof.mainEmail),
+                              userId=prof.key.id())
+                    for prof in profiles if prof.mainEmail]
+        existing = ndb.get_multi([mapping.key for mapping in mappings])
+        ndb.put_multi([mapping for mapping, found in zip(mappings, existing)
+                       if not found])
+        if more and next_cursor:
+            taskqueue.add(params={'cursor': next_cursor.urlsafe()},
+                          url='/tasks/backfill_profiles',
+                          method='GET')
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _createProfile(p_key, user):
+        """Create a Profile and map its user's email to its id in one
+        transaction; if another request mapped the email first, return
+        that Profile instead.
+        """
+        email_key = ndb.Key(UserEmail, user.email())
+        mapping = email_key.get()
+        if mapping and mapping.userId != p_key.id():
+            return ndb.Key(Profile, mapping.userId).get()
+
+        profile = p_key.get()
+        if not profile:
+            profile = Profile(key=p_key,
+                              displayName=user.nickname(),
+                              mainEmail=user.email(),
+                              teeShirtSize=str(TeeShirtSize.NOT_SPECIFIED),)
+            ndb.put_multi([profile, UserEmail(key=email_key,
+                                              userId=p_key.id())])
+        return profile
+
     def _getProfileFromUser(self):
         """Return user Profile from datastore, creating new one
         if non-existent."""
@@ -382,14 +1154,13 @@ class ConferenceApi(remote.Service):
         # get Profile from datastore
         user_id = getUserId(user)
         p_key = ndb.Key(Profile, user_id)
-        profile = p_key.get()
+        profile = unitofwork.track(p_key.get())
         # create new Profile if not there
         if not profile:
-            profile = Profile(key=p_key,
-                              displayName=user.nickname(),
-                              mainEmail=user.email(),
-                              teeShirtSize=str(TeeShirtSize.NOT_SPECIFIED),)
-            profile.put()
+            profile = unitofwork.track(self._createProfile(p_key, user))
+        # move registrations/wishlist still held in legacy lists
+        elif profile.conferenceKeysToAttend or profile.sessionKeysToAttend:
+            profile = unitofwork.track(self._backfillProfile(p_key))
 
         return profile      # return Profile
 
@@ -400,6 +1171,7 @@ class ConferenceApi(remote.Service):
 
         # if saveProfile(), process user-modifyable fields
         if save_request:
+            oldDisplayName = prof.displayName
             for field in ('displayName', 'teeShirtSize'):
                 if hasattr(save_request, field):
                     val = getattr(save_request, field)
@@ -409,19 +1181,94 @@ class ConferenceApi(remote.Service):
                         #    setattr(prof, field, str(val).upper())
                         # else:
                         #    setattr(prof, field, val)
-                        prof.put()
+            # written once, and only if changed, at the end of the request
+            unitofwork.put(prof)
+
+            # conferences carry a copy of the organizer's display name;
+            # rewrite them in the background when it changes
+            if prof.displayName != oldDisplayName:
+                unitofwork.afterFlush(lambda: taskqueue.add(
+                    params={'userId': prof.key.id()},
+                    url='/tasks/refresh_organizer_name'))
+            unitofwork.afterFlush(lambda: self._bumpVersions(prof.key))
 
         # return ProfileForm
-        return self._copyProfileToForm(prof)
+        conf_keys = self._registeredConferenceKeysAsync(prof.key)
+        sess_keys = self._wishlistSessionKeysAsync(prof.key)
+        return self._copyProfileToForm(
+            prof, conf_keys.get_result(), sess_keys.get_result())
+
+    @staticmethod
+    def _refreshOrganizerDisplayName(user_id):
+        """Copy the organizer's current displayName onto each of their
+        conferences in put_multi batches; used by refresh task.
+        """
+        p_key = ndb.Key(Profile, user_id)
+        prof = p_key.get()
+        if not prof:
+            return 0
+
+        q = Conference.query(ancestor=p_key)
+        updated = 0
+        cursor = None
+        more = True
+        while more:
+            confs, cursor, more = q.fetch_page(
+                FANOUT_BATCH_SIZE, start_cursor=cursor)
+            stale = [conf for conf in confs
+                     if conf.organizerDisplayName != (prof.displayName or '')]
+            for conf in stale:
+                conf.organizerDisplayName = prof.displayName or ''
+            ndb.put_multi(stale)
+            ConferenceApi._bumpVersions(*[conf.key for conf in stale])
+            updated += len(stale)
+        return updated
+
+    @staticmethod
+    def _backfillOrganizerNames(cursor=None):
+        """Copy organizers' display names onto one page of Conferences
+        stored before they were kept there, then chain a task for the
+        next page; used by backfill organizer names task.
+        """
+        if cursor:
+            cursor = ndb.Cursor(urlsafe=cursor)
+        confs, next_cursor, more = Conference.query().fetch_page(
+            BACKFILL_BATCH_SIZE, start_cursor=cursor)
+        stale = [conf for conf in confs if conf.organizerDisplayName is None]
+        profiles = ndb.get_multi(set(conf.key.parent() for conf in stale))
+        names = dict((prof.key, prof.displayName)
+                     for prof in profiles if prof)
+        # '' when there's no name, so reads never look for it again
+        for conf in stale:
+            conf.organizerDisplayName = names.get(conf.key.parent()) or ''
+        ndb.put_multi(stale)
+        ConferenceApi._bumpVersions(*[conf.key for conf in stale])
+        if more and next_cursor:
+            taskqueue.add(params={'cursor': next_cursor.urlsafe()},
+                          url='/tasks/backfill_organizer_names',
+                          method='GET')
 
     @endpoints.method(message_types.VoidMessage, ProfileForm,
                       path='profile', http_method='GET', name='getProfile')
+    @unitofwork.perRequest
     def getProfile(self, request):
         """Return user profile."""
-        return self._doProfile()
+        # make sure user is authed
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+
+        # polling clients that have the current version get nothing else
+        etag = self._etag('p', ndb.Key(Profile, getUserId(user)))
+        if self._notModified(etag):
+            return ProfileForm(etag=etag, notModified=True)
+        pf = self._doProfile()
+        pf.etag = etag
+        return pf
 
     @endpoints.method(ProfileMiniForm, ProfileForm,
                       path='profile', http_method='POST', name='saveProfile')
+    @unitofwork.perRequest
     def saveProfile(self, request):
         """Update & return user profile."""
         return self._doProfile(request)
@@ -429,50 +1276,149 @@ class ConferenceApi(remote.Service):
 
 # - - - Announcements - - - - - - - - - - - - - - - - - - - -
 
+    @staticmethod
+    def _nearlySoldOut(seats):
+        """Whether a Conference with seats available is announced."""
+        return 0 < (seats or 0) <= NEARLY_SOLD_OUT_SEATS
+
+    @staticmethod
+    def _formatAnnouncement(nearly):
+        """Format the Announcement for websafe key -> name of the nearly
+        sold out Conferences."""
+        if not nearly:
+            return ""
+        return ANNOUNCEMENT_TPL % ', '.join(sorted(nearly.values()))
+
     @staticmethod
     def _cacheAnnouncement():
-        """Create Announcement & assign to memcache; used by
-        memcache cron job & putAnnouncement().
+        """Rebuild the nearly sold out Conferences in memcache with a
+        full scan & return the Announcement; used by the reconciliation
+        cron job & getAnnouncement() when memcache has lost them.
         """
         confs = Conference.query(ndb.AND(
-            Conference.seatsAvailable <= 5,
+            Conference.seatsAvailable <= NEARLY_SOLD_OUT_SEATS,
             Conference.seatsAvailable > 0)
         ).fetch(projection=[Conference.name])
 
-        if confs:
-            # If there are almost sold out conferences,
-            # format announcement and set it in memcache
-            announcement = ANNOUNCEMENT_TPL % (
-                ', '.join(conf.name for conf in confs))
-            memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
-        else:
-            # If there are no sold out conferences,
-            # delete the memcache announcements entry
-            announcement = ""
-            memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
+        nearly = dict((conf.key.urlsafe(), conf.name) for conf in confs)
+        memcache.set(MEMCACHE_NEARLY_SOLD_OUT_KEY, nearly)
+        return ConferenceApi._formatAnnouncement(nearly)
 
-        return announcement
+    @staticmethod
+    def _updateAnnouncement(wsck, name, seats):
+        """Add a Conference to, or drop it from, the nearly sold out
+        Conferences in memcache after its seats (or name) changed, with
+        compare-and-set so concurrent updates aren't lost.
+        """
+        nearly_sold_out = ConferenceApi._nearlySoldOut(seats)
+        client = memcache.Client()
+        for _ in range(MEMCACHE_CAS_RETRIES):
+            nearly = client.gets(MEMCACHE_NEARLY_SOLD_OUT_KEY)
+            if nearly is None:
+                # rebuilt in full by the next getAnnouncement()
+                return
+            if nearly_sold_out:
+                if nearly.get(wsck) == name:
+                    return
+                nearly[wsck] = name
+            elif wsck in nearly:
+                del nearly[wsck]
+            else:
+                return
+            if client.cas(MEMCACHE_NEARLY_SOLD_OUT_KEY, nearly):
+                return
+        # still contended; have the next read rebuild it
+        memcache.delete(MEMCACHE_NEARLY_SOLD_OUT_KEY)
 
     @staticmethod
-    def _setFeaturedSpeaker(conf_key, speaker_key):
-        """Create Featured Speaker text and assign to memcache;
-           used by getFeaturedSpeaker().
+    def _speakerStatsKey(c_key):
+        """Return the key of a Conference's SpeakerStats."""
+        return ndb.Key(SpeakerStats, 'speakers', parent=c_key)
+
+    @staticmethod
+    def _countSpeakerSessions(c_key, sessions):
+        """Count new Sessions of a Conference into its SpeakerStats
+        within the caller's transaction and return it for putting.
+        Conferences without SpeakerStats yet are first counted from
+        their other Sessions.
         """
-        conf = ndb.Key(urlsafe=conf_key).get()
-        speaker = ndb.Key(urlsafe=speaker_key).get()
+        stats = ConferenceApi._speakerStatsKey(c_key).get()
+        if not stats:
+            new_keys = set(sess.key for sess in sessions)
+            stats = SpeakerStats(
+                key=ConferenceApi._speakerStatsKey(c_key),
+                counts=dict(Counter(
+                    sess.speaker.urlsafe()
+                    for sess in Session.query(ancestor=c_key)
+                    if sess.speaker and sess.key not in new_keys)))
+        counts = stats.counts or {}
+        for sess in sessions:
+            if sess.speaker:
+                wsk = sess.speaker.urlsafe()
+                counts[wsk] = counts.get(wsk, 0) + 1
+        stats.counts = counts
+        return stats
 
-        q = Session.query(ancestor=conf.key)
-        q = q.filter(Session.speaker == speaker.key).fetch()
+    @staticmethod
+    def _scheduleFeaturedSpeaker(wsck):
+        """Enqueue one set featured speaker task per Conference per
+        FEATURED_SPEAKER_DELAY window, however many sessions are added.
+        """
+        window = int(time.time() / FEATURED_SPEAKER_DELAY)
+        try:
+            taskqueue.add(params={'websafeConferenceKey': wsck},
+                          url='/tasks/set_featured_speaker',
+                          method='GET',
+                          name='featured-%s-%d' % (wsck, window),
+                          countdown=FEATURED_SPEAKER_DELAY)
+        except (taskqueue.TaskAlreadyExistsError,
+                taskqueue.TombstonedTaskError):
+            pass
 
+    @staticmethod
+    def _setFeaturedSpeaker(wsck):
+        """Pick a Conference's featured speaker from its session counts
+        and assign the text to memcache; used by getFeaturedSpeaker().
+        The speaker with the most sessions is featured if they have more
+        than one; the current one stays featured on a tie.
+        """
+        c_key = ndb.Key(urlsafe=wsck)
+        conf, stats = ndb.get_multi(
+            [c_key, ConferenceApi._speakerStatsKey(c_key)])
+        if not conf or not stats:
+            return None
+
+        counts = stats.counts or {}
+        top = max(counts.values()) if counts else 0
+        sp_key = None
+        featured_speaker = None
         # if number of sessions for this speaker is > 1
         # then this is the featured speaker
-        if len(q) > 1:
-            # format announcement and set it in memcache
-            featured_speaker = "Our featured speaker for %s is: %s %s!" \
-                % (conf.name, speaker.firstName, speaker.lastName)
+        if top > 1:
+            leaders = sorted(wsk for wsk, n in counts.items() if n == top)
+            current = (stats.featuredSpeaker.urlsafe()
+                       if stats.featuredSpeaker else None)
+            sp_key = ndb.Key(urlsafe=current if current in leaders
+                             else leaders[0])
+            speaker = sp_key.get()
+            if speaker:
+                featured_speaker = \
+                    "Our featured speaker for %s is: %s %s!" \
+                    % (conf.name, speaker.firstName, speaker.lastName)
+
+        @ndb.transactional
+        def _update():
+            stats = ConferenceApi._speakerStatsKey(c_key).get()
+            stats.featuredSpeaker = sp_key
+            stats.featured = featured_speaker
+            stats.put()
+
+        _update()
+        memcache.set(MEMCACHE_CONF_FEATURED_SPEAKER_KEY % wsck,
+                     featured_speaker or "")
+        if featured_speaker:
+            # the latest of any conference, for callers not naming one
             memcache.set(MEMCACHE_FEATURED_SPEAKER_KEY, featured_speaker)
-        else:
-            featured_speaker = None
         return featured_speaker
 
     @endpoints.method(message_types.VoidMessage, StringMessage,
@@ -480,106 +1426,409 @@ class ConferenceApi(remote.Service):
                       http_method='GET', name='getAnnouncement')
     def getAnnouncement(self, request):
         """Return Announcement from memcache."""
-        return StringMessage(data=memcache.get(
-                             MEMCACHE_ANNOUNCEMENTS_KEY) or "")
+        nearly = memcache.get(MEMCACHE_NEARLY_SOLD_OUT_KEY)
+        if nearly is None:
+            return StringMessage(data=self._cacheAnnouncement())
+        return StringMessage(data=self._formatAnnouncement(nearly))
 
-    @endpoints.method(message_types.VoidMessage, StringMessage,
+    @endpoints.method(FEATURED_GET_REQUEST, StringMessage,
                       path='conference/featured_speaker/get',
                       http_method='GET', name='getFeaturedSpeaker')
-    def getAnnouncement(self, request):
-        """Return Featured Speaker from memcache."""
-        return StringMessage(data=memcache.get(
-                             MEMCACHE_FEATURED_SPEAKER_KEY) or "")
+    def getFeaturedSpeaker(self, request):
+        """Return Featured Speaker of a Conference (by
+        websafeConferenceKey), or the latest of any Conference."""
+        wsck = request.websafeConferenceKey
+        if not wsck:
+            return StringMessage(data=memcache.get(
+                                 MEMCACHE_FEATURED_SPEAKER_KEY) or "")
+
+        try:
+            c_key = ndb.Key(urlsafe=wsck)
+        except:
+            c_key = None
+        if not c_key or c_key.kind() != Conference._get_kind():
+            raise endpoints.NotFoundException(
+                'No conference found for key: %s' % wsck)
+
+        cache_key = MEMCACHE_CONF_FEATURED_SPEAKER_KEY % c_key.urlsafe()
+        featured_speaker = memcache.get(cache_key)
+        if featured_speaker is None:
+            stats = self._speakerStatsKey(c_key).get()
+            featured_speaker = (stats.featured or "") if stats else ""
+            memcache.set(cache_key, featured_speaker)
+        return StringMessage(data=featured_speaker)
 
 # - - - Registration - - - - - - - - - - - - - - - - - - - -
 
+    @staticmethod
+    def _seatShardKeys(c_key):
+        """Return keys of the seat shards for a Conference; shards are
+        root entities so each one is its own entity group.
+        """
+        return [ndb.Key(SeatShard, '%s-%d' % (c_key.urlsafe(), i))
+                for i in range(NUM_SEAT_SHARDS)]
+
+    @staticmethod
+    def _splitSeats(seats):
+        """Split a seat count as evenly as possible across the shards."""
+        base, extra = divmod(max(seats or 0, 0), NUM_SEAT_SHARDS)
+        return [base + (1 if i < extra else 0)
+                for i in range(NUM_SEAT_SHARDS)]
+
+    @staticmethod
     @ndb.transactional(xg=True)
-    def _conferenceRegistration(self, request, reg=True):
-        """Register or unregister user for selected conference."""
-        retval = None
-        prof = self._getProfileFromUser()  # get user Profile
+    def _createSeatShards(c_key, seats):
+        """Create seat shards for a Conference stored before seats were
+        sharded, unless a concurrent request already has.
+        """
+        keys = ConferenceApi._seatShardKeys(c_key)
+        shards = ndb.get_multi(keys)
+        if None not in shards:
+            return shards
+        shards = [SeatShard(key=k, seats=n) for k, n in
+                  zip(keys, ConferenceApi._splitSeats(seats))]
+        ndb.put_multi(shards)
+        return shards
+
+    def _resizeSeatShards(self, conf, delta):
+        """Add (or remove) delta seats across the shards of conf; runs
+        inside the _updateConferenceObject() transaction.
+        """
+        shards = ndb.get_multi(self._seatShardKeys(conf.key))
+        if None in shards:
+            # not sharded yet; shards are created from this count later
+            conf.seatsAvailable = max((conf.seatsAvailable or 0) + delta, 0)
+            return
+
+        if delta > 0:
+            for shard, seats in zip(shards, self._splitSeats(delta)):
+                shard.seats += seats
+        else:
+            # take seats from the fullest shards first, never below zero
+            remaining = -delta
+            for shard in sorted(shards, key=lambda sh: -sh.seats):
+                taken = min(shard.seats, remaining)
+                shard.seats -= taken
+                remaining -= taken
+        ndb.put_multi(shards)
+        conf.seatsAvailable = sum(shard.seats for shard in shards)
 
-        # check if conf exists given websafeConfKey
-        # get conference; check that it exists
-        wsck = request.websafeConferenceKey
+    @staticmethod
+    def _aggregateSeats(wsck):
+        """Write the total of a Conference's seat shards back to its
+        seatsAvailable; used by aggregate seats task.
+        """
+        c_key = ndb.Key(urlsafe=wsck)
+        shards = ndb.get_multi(ConferenceApi._seatShardKeys(c_key))
+        if None in shards:
+            return None
+        total = sum(shard.seats for shard in shards)
+
+        @ndb.transactional()
+        def _store():
+            conf = c_key.get()
+            if conf and conf.seatsAvailable != total:
+                old_seats = conf.seatsAvailable
+                conf.seatsAvailable = total
+                conf.put()
+                return conf, old_seats
+            return None, None
+        conf, old_seats = _store()
+        if conf:
+            ConferenceApi._bumpVersions(c_key)
+            # cached projection pages may hold the old seatsAvailable
+            ConferenceApi._invalidateQueryCache(
+                ConferenceApi._conferenceGenerationKeys(conf))
+
+        # announce it once it crosses the nearly sold out threshold
+        if conf and ConferenceApi._nearlySoldOut(old_seats) != \
+                ConferenceApi._nearlySoldOut(total):
+            ConferenceApi._updateAnnouncement(wsck, conf.name, total)
+        return total
+
+    @staticmethod
+    def _scheduleSeatAggregation(wsck):
+        """Enqueue one aggregate seats task per Conference per
+        SEAT_AGGREGATION_DELAY window.
+        """
+        window = int(time.time() / SEAT_AGGREGATION_DELAY)
         try:
-            conf = ndb.Key(urlsafe=wsck).get()
-        except:
-            conf = None
+            taskqueue.add(params={'websafeConferenceKey': wsck},
+                          url='/tasks/aggregate_seats',
+                          name='seats-%s-%d' % (wsck, window),
+                          countdown=SEAT_AGGREGATION_DELAY)
+        except (taskqueue.TaskAlreadyExistsError,
+                taskqueue.TombstonedTaskError):
+            pass
 
-        if not conf:
-            raise endpoints.NotFoundException(
-                'No conference found for key: %s' % wsck)
+    @ndb.transactional(xg=True)
+    def _reserveSeat(self, reg_key, shard_key, reg=True):
+        """Register or unregister user, taking the seat from (or giving
+        it back to) one shard; returns None if that shard sold out.
+        """
+        registration, shard = ndb.get_multi([reg_key, shard_key])
 
         # register
         if reg:
             # check if user already registered otherwise add
-            if wsck in prof.conferenceKeysToAttend:
+            if registration:
                 raise ConflictException(
                     "You have already registered for this conference")
 
-            # check if seats avail
-            if conf.seatsAvailable <= 0:
-                raise ConflictException(
-                    "There are no seats available.")
+            # another registration took this shard's last seat
+            if shard.seats <= 0:
+                return None
 
             # register user, take away one seat
-            prof.conferenceKeysToAttend.append(wsck)
-            conf.seatsAvailable -= 1
-            retval = True
+            registration = Registration(
+                key=reg_key, conference=ndb.Key(urlsafe=reg_key.id()))
+            shard.seats -= 1
+            ndb.put_multi([registration, shard])
 
         # unregister
         else:
             # check if user already registered
-            if wsck in prof.conferenceKeysToAttend:
+            if not registration:
+                return False
+
+            # unregister user, add back one seat
+            shard.seats += 1
+            reg_key.delete()
+            shard.put()
 
-                # unregister user, add back one seat
-                prof.conferenceKeysToAttend.remove(wsck)
-                conf.seatsAvailable += 1
-                retval = True
+        # seat shards are not part of any query; cached query pages
+        # holding seatsAvailable expire when the shards are aggregated
+        return True
+
+    @ndb.transactional(xg=True)
+    def _reserveSeats(self, reservations):
+        """Register user for several conferences at once, taking one seat
+        from the given shard of each; reservations is a list of
+        (Registration key, SeatShard key). Returns True, False (already
+        registered) or None (shard sold out) per reservation.
+        """
+        reg_keys = [reg_key for reg_key, _ in reservations]
+        shard_keys = [shard_key for _, shard_key in reservations]
+        entities = ndb.get_multi(reg_keys + shard_keys)
+
+        results = []
+        to_put = []
+        for reg_key, registration, shard in zip(
+                reg_keys, entities[:len(reg_keys)],
+                entities[len(reg_keys):]):
+            if registration:
+                results.append(False)
+            elif shard.seats <= 0:
+                results.append(None)
             else:
-                retval = False
+                shard.seats -= 1
+                to_put.append(shard)
+                to_put.append(Registration(
+                    key=reg_key, conference=ndb.Key(urlsafe=reg_key.id())))
+                results.append(True)
+        ndb.put_multi(to_put)
+        return results
 
-        # write things back to the datastore & return
-        prof.put()
-        conf.put()
+    def _conferenceRegistration(self, request, reg=True):
+        """Register or unregister user for selected conference."""
+        retval = None
+        prof = self._getProfileFromUser()  # get user Profile
+
+        # check if conf exists given websafeConfKey
+        # get conference; check that it exists
+        wsck = request.websafeConferenceKey
+        try:
+            c_key = ndb.Key(urlsafe=wsck)
+        except:
+            c_key = None
+
+        # registration is keyed by the conference, so membership is a
+        # get; fetch it with the conference and its seat shards
+        if c_key and c_key.kind() == Conference._get_kind():
+            reg_key = ndb.Key(Registration, c_key.urlsafe(), parent=prof.key)
+            entities = ndb.get_multi(
+                [c_key, reg_key] + self._seatShardKeys(c_key))
+        else:
+            entities = [None]
+        conf = entities[0]
+
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found for key: %s' % wsck)
+
+        if reg and entities[1]:
+            raise ConflictException(
+                "You have already registered for this conference")
+
+        # seats live in shards so registrations for one conference
+        # don't all contend on a single entity group
+        shards = entities[2:]
+        if None in shards:
+            shards = self._createSeatShards(conf.key, conf.seatsAvailable)
+
+        # try shards in random order, only those with seats left
+        # when registering; a sold out shard moves on to the next
+        if reg:
+            shards = [shard for shard in shards if shard.seats > 0]
+        random.shuffle(shards)
+        for shard in shards:
+            retval = self._reserveSeat(reg_key, shard.key, reg)
+            if retval is not None:
+                break
+
+        if retval is None:
+            raise ConflictException(
+                "There are no seats available.")
+
+        # seatsAvailable on the Conference catches up shortly after
+        if retval:
+            self._scheduleSeatAggregation(conf.key.urlsafe())
+            self._bumpVersions(prof.key)
         return BooleanMessage(data=retval)
 
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
                       path='conferences/attending',
                       http_method='GET', name='getConferencesToAttend')
+    @unitofwork.perRequest
     def getConferencesToAttend(self, request):
         """Get list of conferences that user has registered for."""
         prof = self._getProfileFromUser()  # get user Profile
-        conf_keys = [ndb.Key(urlsafe=wsck) for wsck in
-                     prof.conferenceKeysToAttend]
+        conf_keys = self._registeredConferenceKeysAsync(
+            prof.key).get_result()
         conferences = ndb.get_multi(conf_keys)
 
-        # get organizers
-        organisers = [ndb.Key(Profile, conf.organizerUserId) for
-                      conf in conferences]
-        profiles = ndb.get_multi(organisers)
-
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
-
         # return set of ConferenceForm objects per Conference
-        return ConferenceForms(items=[self._copyConferenceToForm(
-                               conf, names[conf.organizerUserId]) for
-                               conf in conferences])
+        return ConferenceForms(
+            items=self._copyConferencesToForms(conferences))
 
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
                       path='conference/{websafeConferenceKey}',
                       http_method='POST', name='registerForConference')
+    @unitofwork.perRequest
     def registerForConference(self, request):
         """Register user for selected conference."""
         return self._conferenceRegistration(request)
 
+    @endpoints.method(ConferenceRegistrationForm,
+                      ConferenceRegistrationResults,
+                      path='conferences/register',
+                      http_method='POST', name='registerForConferences')
+    @unitofwork.perRequest
+    def registerForConferences(self, request):
+        """Register user for several conferences, with a result for each."""
+        prof = self._getProfileFromUser()  # get user Profile
+
+        # drop duplicates, keeping the order they were given in
+        wscks = []
+        for wsck in request.websafeConferenceKeys:
+            if wsck not in wscks:
+                wscks.append(wsck)
+        if len(wscks) > MAX_BATCH_REGISTRATIONS:
+            raise endpoints.BadRequestException(
+                "At most %d conferences can be registered for at once."
+                % MAX_BATCH_REGISTRATIONS)
+
+        results = dict((wsck, ConferenceRegistrationResult(
+            websafeConferenceKey=wsck, registered=False)) for wsck in wscks)
+
+        c_keys = {}
+        for wsck in wscks:
+            try:
+                c_key = ndb.Key(urlsafe=wsck)
+            except:
+                c_key = None
+            if c_key and c_key.kind() == Conference._get_kind():
+                c_keys[wsck] = c_key
+            else:
+                results[wsck].error = 'No conference found for key: %s' % wsck
+
+        # validate conferences, existing registrations and seat shards
+        # with one get_multi
+        valid = [wsck for wsck in wscks if wsck in c_keys]
+        keys = []
+        for wsck in valid:
+            c_key = c_keys[wsck]
+            keys.append(c_key)
+            keys.append(ndb.Key(Registration, c_key.urlsafe(),
+                                parent=prof.key))
+            keys.extend(self._seatShardKeys(c_key))
+        entities = ndb.get_multi(keys)
+
+        stride = 2 + NUM_SEAT_SHARDS
+        pending = {}
+        for i, wsck in enumerate(valid):
+            conf, registration = entities[i * stride:i * stride + 2]
+            shards = entities[i * stride + 2:(i + 1) * stride]
+            if not conf:
+                results[wsck].error = 'No conference found for key: %s' % wsck
+                continue
+            if registration:
+                results[wsck].error = \
+                    "You have already registered for this conference"
+                continue
+            if None in shards:
+                shards = self._createSeatShards(conf.key, conf.seatsAvailable)
+            shards = [shard for shard in shards if shard.seats > 0]
+            random.shuffle(shards)
+            pending[wsck] = (ndb.Key(Registration, conf.key.urlsafe(),
+                                     parent=prof.key), shards)
+
+        # reserve a seat in every pending conference in one transaction;
+        # conferences whose shard sold out or was contended meanwhile
+        # try their next shard
+        contended = set()
+        while pending:
+            batch = []
+            for wsck in list(pending):
+                reg_key, shards = pending[wsck]
+                if not shards:
+                    results[wsck].error = (
+                        "Too many registrations at once, please try again."
+                        if wsck in contended
+                        else "There are no seats available.")
+                    del pending[wsck]
+                    continue
+                batch.append((wsck, reg_key, shards.pop().key))
+            if not batch:
+                break
+
+            try:
+                outcomes = self._reserveSeats(
+                    [(reg_key, shard_key) for _, reg_key, shard_key in batch])
+            except datastore_errors.TransactionFailedError:
+                # one contended shard fails the whole round; reserve each
+                # conference on its own so the others still go through
+                outcomes = []
+                for wsck, reg_key, shard_key in batch:
+                    try:
+                        outcome = self._reserveSeat(reg_key, shard_key)
+                        contended.discard(wsck)
+                    except ConflictException:
+                        outcome = False
+                    except datastore_errors.TransactionFailedError:
+                        contended.add(wsck)
+                        outcome = None
+                    outcomes.append(outcome)
+            for (wsck, _, _), outcome in zip(batch, outcomes):
+                if outcome is None:
+                    continue
+                if outcome:
+                    results[wsck].registered = True
+                    self._scheduleSeatAggregation(c_keys[wsck].urlsafe())
+                else:
+                    results[wsck].error = \
+                        "You have already registered for this conference"
+                del pending[wsck]
+
+        if any(result.registered for result in results.values()):
+            self._bumpVersions(prof.key)
+        return ConferenceRegistrationResults(
+            items=[results[wsck] for wsck in wscks])
+
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
                       path='conference/{websafeConferenceKey}',
                       http_method='DELETE', name='unregisterFromConference')
+    @unitofwork.perRequest
     def unregisterFromConference(self, request):
         """Unregister user for selected conference."""
         return self._conferenceRegistration(request, reg=False)
@@ -600,38 +1849,54 @@ class ConferenceApi(remote.Service):
         q = q.filter(Conference.month == 6)
 
         return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, "") for conf in q]
+            items=self._copyConferencesToForms(q.fetch())
         )
 
 # - - - Sessions - - - - - - - - - - - - - - - - - - - -
-    def _copySessionToForm(self, sess):
-        """Copy relevant fields from Session to SessionForm."""
-        sf = SessionForm()
-        for field in sf.all_fields():
-            if hasattr(sess, field.name):
-                # Convert Date to string
-                # Convert Time to string in HH:MM only
-                # else convert others as is
-                if field.name.endswith('date'):
-                    setattr(sf, field.name, str(getattr(sess, field.name)))
-                elif field.name.endswith('Time'):
-                    setattr(sf, field.name,
-                            str(getattr(sess, field.name).strftime("%H:%M")))
-                else:
-                    setattr(sf, field.name, getattr(sess, field.name))
-            elif field.name == "sessionWebSafeKey":
-                setattr(sf, field.name, sess.key.urlsafe())
-            elif field.name == "speakerName":
-                try:
-                    speaker = sess.speaker.get()
-                    speakerName = "%s %s" % (getattr(speaker, "firstName"),
-                                             getattr(speaker, "lastName"))
-                    setattr(sf, 'speakerName', speakerName)
-                except:
-                    pass
-        sf.check_initialized()
+    def _copySessionToForm(self, sess, speakers):
+        """Copy relevant fields from Session to SessionForm; speakers
+        maps speaker keys to Speakers (see _copySessionsToForms())."""
+        # Convert Date to string
+        # Convert Time to string in HH:MM only
+        # else convert others as is
+        sf = self._applyFormPlan(SESSION_FORM_PLAN, SessionForm, sess)
+        speaker = speakers.get(sess.speaker)
+        if speaker:
+            sf.speakerName = "%s %s" % (speaker.firstName, speaker.lastName)
         return sf
 
+    def _copySessionsToForms(self, sessions):
+        """Copy Sessions to SessionForms, resolving the distinct speakers
+        of the whole result set with one get_multi."""
+        sessions = [sess for sess in sessions if sess]
+        speaker_keys = list(set(sess.speaker for sess in sessions
+                                if sess.speaker))
+        speakers = dict(zip(speaker_keys, ndb.get_multi(speaker_keys)))
+        return SessionForms(
+            items=[self._copySessionToForm(sess, speakers)
+                   for sess in sessions]
+        )
+
+    @staticmethod
+    def _sessionData(request):
+        """Convert SessionForm into Session property values."""
+        data = {field.name: getattr(request, field.name) for
+                field in request.all_fields()}
+
+        # convert dates/times from strings to Date/Time objects
+        if data['date']:
+            data['date'] = datetime.strptime(
+                           data['date'][:10], "%Y-%m-%d").date()
+        if data['startTime']:
+            data['startTime'] = datetime.strptime(
+                                data['startTime'][:5], "%H:%M").time()
+
+        del data['conferenceWebSafeKey']
+        del data['sessionWebSafeKey']
+        del data['speakerName']
+        del data['speakerWebSafeKey']
+        return data
+
     def _createSessionObject(self, request):
         """Create a Session, returning SessionForm/request."""
         # preload necessary data items
@@ -644,12 +1909,9 @@ class ConferenceApi(remote.Service):
             raise endpoints.BadRequestException(
                 "Session 'name' field required")
 
-        data = {field.name: getattr(request, field.name) for
-                field in request.all_fields()}
-
         # get existing conference using web safe key
         try:
-            conf = ndb.Key(urlsafe=data['conferenceWebSafeKey']).get()
+            conf = ndb.Key(urlsafe=request.conferenceWebSafeKey).get()
         except:
             conf = None
 
@@ -657,7 +1919,7 @@ class ConferenceApi(remote.Service):
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found for key: %s' \
-                % data['conferenceWebSafeKey'])
+                % request.conferenceWebSafeKey)
 
         if user_id != conf.organizerUserId:
             raise endpoints.ForbiddenException(
@@ -665,8 +1927,7 @@ class ConferenceApi(remote.Service):
 
         # get speaker using web safe key
         try:
-            speaker = ndb.Key(urlsafe=data['speakerWebSafeKey']).get()
-            data['speaker'] = speaker.key
+            speaker = ndb.Key(urlsafe=request.speakerWebSafeKey).get()
             # check parent of key to confirm Speaker is owned by user
             speaker_parent = speaker.key.parent().pairs()
             speaker_parent = speaker_parent[0][1]
@@ -678,31 +1939,29 @@ class ConferenceApi(remote.Service):
             raise endpoints.ForbiddenException(
                 'Only the Speaker owner can use this speaker.')
 
-        # convert dates/times from strings to Date/Time objects
-        if data['date']:
-            data['date'] = datetime.strptime(
-                           data['date'][:10], "%Y-%m-%d").date()
-        if data['startTime']:
-            data['startTime'] = datetime.strptime(
-                                data['startTime'][:5], "%H:%M").time()
+        data = self._sessionData(request)
+        data['speaker'] = speaker.key
 
         # generate Session ID based on Conf key, get Session key from ID
         session_id = Session.allocate_ids(size=1, parent=conf.key)[0]
         session_key = ndb.Key(Session, session_id, parent=conf.key)
         data['key'] = session_key
-        del data['conferenceWebSafeKey']
-        del data['sessionWebSafeKey']
-        del data['speakerName']
-        del data['speakerWebSafeKey']
 
-        # create Session
-        Session(**data).put()
+        # create Session, counting it for its speaker and indexing it for
+        # search; all are in the Conference's entity group
+        session = Session(**data)
+
+        @ndb.transactional
+        def _put():
+            ndb.put_multi([session, search.documentFor(session),
+                           self._countSpeakerSessions(conf.key, [session])])
+
+        _put()
+        self._enqueueAgendaRebuilds([conf.key.urlsafe()])
 
-        # add a task to see if this new session creates a featured speaker
-        taskqueue.add(params={'websafeConferenceKey': conf.key.urlsafe(),
-                      'websafeSpeakerKey': speaker.key.urlsafe()},
-                      url='/tasks/set_featured_speaker',
-                      method='GET')
+        # see if this new session creates a featured speaker, once per
+        # conference however many sessions are being added
+        self._scheduleFeaturedSpeaker(conf.key.urlsafe())
 
         return request
 
@@ -724,31 +1983,210 @@ class ConferenceApi(remote.Service):
             raise endpoints.NotFoundException(
                 'No session found for key: %s' % session_wsck)
 
-        # add
-        if add:
+        # wishlist entries are keyed by the session, so membership is a
+        # get inside the Profile's entity group
+        entry_key = ndb.Key(WishlistEntry, session.key.urlsafe(),
+                            parent=prof.key)
+
+        @ndb.transactional()
+        def _update():
+            entry = entry_key.get()
+            # add
+            if add:
+                # check if user already has session in wishlist
+                if entry:
+                    raise ConflictException(
+                        "You already have this session on your wishlist.")
+
+                # add session to wishlist
+                WishlistEntry(key=entry_key, session=session.key).put()
+                return True
+
+            # remove
             # check if user already has session in wishlist
-            if session_wsck in prof.sessionKeysToAttend:
-                raise ConflictException(
-                    "You already have this session on your wishlist.")
+            if not entry:
+                return False
 
-            # add session to wishlist
-            prof.sessionKeysToAttend.append(session_wsck)
-            retval = True
+            # remove session from wishlist
+            entry_key.delete()
+            return True
 
-        # remove
-        else:
-            # check if user already has session in wishlist
-            if session_wsck in prof.sessionKeysToAttend:
+        retval = _update()
+        if retval:
+            self._bumpVersions(prof.key)
+        return BooleanMessage(data=retval)
 
-                # remove session from wishlist
-                prof.sessionKeysToAttend.remove(session_wsck)
-                retval = True
+    @ndb.tasklet
+    def _getConferenceSessionsAsync(self, wsck, *filters):
+        """Get Conference by websafe key and its (filtered) Sessions with
+        the get and the ancestor query in flight at the same time.
+        """
+        try:
+            c_key = ndb.Key(urlsafe=wsck)
+        except:
+            c_key = None
+
+        if not c_key or c_key.kind() != Conference._get_kind():
+            raise endpoints.NotFoundException(
+                'No conference found for key: %s' % wsck)
+
+        # both RPCs only need the key, so issue them concurrently
+        q = Session.query(ancestor=c_key)
+        for f in filters:
+            q = q.filter(f)
+        conf, sessions = yield c_key.get_async(), q.fetch_async()
+
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found for key: %s' % wsck)
+        raise ndb.Return(conf, sessions)
+
+    @staticmethod
+    def _pageRequest(request):
+        """Check a request's pageSize and pageToken; returns (page size,
+        cursor or None)."""
+        page_size = request.pageSize or DEFAULT_PAGE_SIZE
+        if page_size < 1 or page_size > MAX_PAGE_SIZE:
+            raise endpoints.BadRequestException(
+                "pageSize must be between 1 and %d." % MAX_PAGE_SIZE)
+        cursor = None
+        if request.pageToken:
+            try:
+                cursor = ndb.Cursor(urlsafe=request.pageToken)
+            except:
+                raise endpoints.BadRequestException(
+                    "Invalid pageToken: %s" % request.pageToken)
+        return page_size, cursor
+
+    @staticmethod
+    def _sessionsBefore(startTime, page_size, cursor=None, isWorkshop=None,
+                        ancestor=None):
+        """Return a page of Sessions starting before startTime, in start
+        time order, optionally only (non-)workshops and only those of
+        one Conference, as (sessions, next cursor, more); each variant
+        is a single indexed scan.
+        """
+        q = Session.query(ancestor=ancestor)
+        if isWorkshop is not None:
+            q = q.filter(Session.isWorkshop == isWorkshop)
+        q = q.filter(Session.startTime < startTime)
+        return q.order(Session.startTime).fetch_page(
+            page_size, start_cursor=cursor)
+
+    @staticmethod
+    def _agendaKey(c_key):
+        """Return the key of a Conference's Agenda."""
+        return ndb.Key(Agenda, 'agenda', parent=c_key)
+
+    @staticmethod
+    def _enqueueAgendaRebuilds(wscks):
+        """Add a rebuild agenda task for each websafe Conference key,
+        one per Conference per AGENDA_REBUILD_DELAY window."""
+        window = int(time.time() / AGENDA_REBUILD_DELAY)
+        tasks = [taskqueue.Task(params={'websafeConferenceKey': wsck},
+                                url='/tasks/rebuild_agenda',
+                                name='agenda-%s-%d' % (wsck, window),
+                                countdown=AGENDA_REBUILD_DELAY)
+                 for wsck in sorted(set(wscks))]
+        for i in range(0, len(tasks), taskqueue.MAX_TASKS_PER_ADD):
+            try:
+                # the rest of a batch is still added when some of its
+                # tasks already exist
+                taskqueue.Queue().add(
+                    tasks[i:i + taskqueue.MAX_TASKS_PER_ADD])
+            except (taskqueue.TaskAlreadyExistsError,
+                    taskqueue.TombstonedTaskError):
+                pass
+
+    @staticmethod
+    def _cacheAgenda(agenda):
+        """Put an Agenda in memcache unless it already holds a newer
+        version. One too large for memcache is cached without its data,
+        so readers go to the datastore and don't get an older version.
+        """
+        key = MEMCACHE_AGENDA_KEY % agenda.key.parent().urlsafe()
+        data = agenda.data
+        if len(data) > MAX_CACHED_AGENDA_BYTES:
+            data = None
+        value = {'version': agenda.version, 'data': data}
+        client = memcache.Client()
+        for _ in range(MEMCACHE_CAS_RETRIES):
+            cached = client.gets(key)
+            if cached is None:
+                if client.add(key, value):
+                    return
+            elif cached['version'] >= agenda.version:
+                return
+            elif client.cas(key, value):
+                return
+
+    def _buildAgenda(self, wsck):
+        """Rebuild a Conference's agenda: its sessions in date/startTime
+        order with speaker names, encoded once. Stored in the datastore
+        and memcache unless a newer build got there first; used by
+        rebuild agenda task. Returns the Agenda.
+        """
+        # taken before reading, so a build that read later state always
+        # carries the higher version
+        version = int(time.time() * 1000000)
+        conf, sessions = self._getConferenceSessionsAsync(wsck).get_result()
+        sessions.sort(key=lambda sess: (sess.date, sess.startTime))
+        agenda = Agenda(key=self._agendaKey(conf.key), version=version,
+                        data=protojson.encode_message(
+                            self._copySessionsToForms(sessions)))
+
+        @ndb.transactional
+        def _store():
+            current = agenda.key.get()
+            if current and current.version >= agenda.version:
+                return current
+            agenda.put()
+            return agenda
+
+        stored = _store()
+        self._cacheAgenda(stored)
+        if stored is agenda:
+            self._bumpVersions(conf.key)
+        return stored
+
+    def _getAgenda(self, wsck):
+        """Return a Conference's agenda as SessionForms with one get:
+        from memcache, else from the datastore; built on first use."""
+        try:
+            c_key = ndb.Key(urlsafe=wsck)
+        except:
+            c_key = None
+        if not c_key or c_key.kind() != Conference._get_kind():
+            raise endpoints.NotFoundException(
+                'No conference found for key: %s' % wsck)
+
+        cached = memcache.get(MEMCACHE_AGENDA_KEY % c_key.urlsafe())
+        if cached and cached['data'] is not None:
+            data = cached['data']
+        else:
+            agenda = self._agendaKey(c_key).get()
+            if agenda:
+                self._cacheAgenda(agenda)
             else:
-                retval = False
+                agenda = self._buildAgenda(c_key.urlsafe())
+            data = agenda.data
+        return protojson.decode_message(SessionForms, data)
 
-        # write things back to the datastore & return
-        prof.put()
-        return BooleanMessage(data=retval)
+    @staticmethod
+    def _backfillSessions(cursor=None):
+        """Rewrite one page of Sessions so their computed properties are
+        stored and indexed, then chain a task for the next page; used by
+        backfill sessions task.
+        """
+        if cursor:
+            cursor = ndb.Cursor(urlsafe=cursor)
+        sessions, next_cursor, more = Session.query().fetch_page(
+            BACKFILL_BATCH_SIZE, start_cursor=cursor)
+        ndb.put_multi(sessions)
+        if more and next_cursor:
+            taskqueue.add(params={'cursor': next_cursor.urlsafe()},
+                          url='/tasks/backfill_sessions',
+                          method='GET')
 
     @endpoints.method(SessionForm, SessionForm,
                       path='conference/create_session',
@@ -767,23 +2205,26 @@ class ConferenceApi(remote.Service):
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
         # user_id = getUserId(user)
-        wsck = request.websafeConferenceKey
+
         try:
-            conf = ndb.Key(urlsafe=wsck).get()
+            c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
         except:
-            conf = None
-
-        if not conf:
+            c_key = None
+        if not c_key or c_key.kind() != Conference._get_kind():
             raise endpoints.NotFoundException(
-                'No conference found for key: %s' % wsck)
+                'No conference found for key: %s' \
+                % request.websafeConferenceKey)
 
-        # create ancestor query for all key matches for this conference
-        sessions = Session.query(ancestor=conf.key)
+        # polling clients that have the current version get nothing else
+        etag = self._etag('s', c_key)
+        if self._notModified(etag):
+            return SessionForms(etag=etag, notModified=True)
 
-        # return set of SessionForm objects for conference
-        return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
-        )
+        # serve the prebuilt agenda; rebuilt by task when sessions or
+        # their speakers change
+        forms = self._getAgenda(request.websafeConferenceKey)
+        forms.etag = etag
+        return forms
 
     @endpoints.method(SessionsByType, SessionForms,
                       path='conference/sessions_by_type',
@@ -795,26 +2236,56 @@ class ConferenceApi(remote.Service):
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
         # user_id = getUserId(user)
-        wsck = request.websafeConferenceKey
-        try:
-            conf = ndb.Key(urlsafe=wsck).get()
-        except:
-            conf = None
-
-        if not conf:
-            raise endpoints.NotFoundException(
-                'No conference found for key: %s' % wsck)
 
-        # create ancestor query for all key matches for this conference
-        # then filter on typeOfSession
-        typeOfSession = request.typeOfSession
-        sessions = Session.query(ancestor=conf.key)
-        sessions = sessions.filter(Session.typeOfSession == typeOfSession)
+        # get conference and run ancestor query for its sessions
+        # filtered on typeOfSession together
+        conf, sessions = self._getConferenceSessionsAsync(
+            request.websafeConferenceKey,
+            Session.typeOfSession == request.typeOfSession).get_result()
 
         # return set of SessionForm objects per Conference
-        return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
-        )
+        return self._copySessionsToForms(sessions)
+
+    @ndb.tasklet
+    def _sessionsBySpeakerAsync(self, lastName, firstName=None,
+                                sessionDate=None, limit=None):
+        """Find Sessions of every Speaker with the given name (and
+        optionally on one date), running one query per speaker
+        concurrently; merged in date/startTime order, at most limit.
+        """
+        if limit is not None and limit < 1:
+            raise endpoints.BadRequestException(
+                "limit must be a positive number.")
+
+        if firstName:
+            # find by first and last name
+            speakers = Speaker.query(ndb.AND(
+                Speaker.lastName == lastName,
+                Speaker.firstName == firstName))
+        else:
+            # find by last name only
+            speakers = Speaker.query(Speaker.lastName == lastName)
+        speaker_keys = yield speakers.fetch_async(keys_only=True)
+
+        # fan out one query per speaker, all in flight together; each
+        # needs at most limit sessions to fill the merged result
+        futures = []
+        for sp_k in speaker_keys:
+            q = Session.query(Session.speaker == sp_k)
+            if sessionDate:
+                q = q.filter(Session.date == sessionDate)
+            q = q.order(Session.date, Session.startTime)
+            futures.append(q.fetch_async(limit))
+        results = yield futures
+
+        # merge, dropping any session found through more than one query
+        sessions = {}
+        for result in results:
+            for sess in result:
+                sessions[sess.key] = sess
+        merged = sorted(sessions.values(),
+                        key=lambda sess: (sess.date, sess.startTime))
+        raise ndb.Return(merged[:limit] if limit else merged)
 
     @endpoints.method(SessionsBySpeaker, SessionForms,
                       path='conference/sessions_by_speaker',
@@ -827,35 +2298,17 @@ class ConferenceApi(remote.Service):
             raise endpoints.UnauthorizedException('Authorization required')
         # user_id = getUserId(user)
 
-        sp_lastName = request.lastName
-        sp_firstName = request.firstName
-
-        if sp_firstName:
-            # find by first and last name
-            speaker = Speaker.query(ndb.AND(
-                Speaker.lastName == sp_lastName,
-                Speaker.firstName == sp_firstName))
-        else:
-            # find by last name only
-            speaker = Speaker.query(Speaker.lastName == sp_lastName)
-
-        speaker_keys = [sp.key for sp in speaker]
-
-        # iterate over each key finding all sessions
-        all_sessions = []
-        for sp_k in speaker_keys:
-            sessions = Session.query(Session.speaker == sp_k)
-            for s in sessions:
-                all_sessions.append(s)
+        all_sessions = self._sessionsBySpeakerAsync(
+            request.lastName, request.firstName,
+            limit=request.limit).get_result()
 
         # return list of sessions that match each of the speaker_keys
-        return SessionForms(
-            items=[self._copySessionToForm(sess) for sess in all_sessions]
-        )
+        return self._copySessionsToForms(all_sessions)
 
     @endpoints.method(AddSessionToWishlist, BooleanMessage,
                       path='session/add_to_wishlist',
                       http_method='POST', name='addSessionToWishlist')
+    @unitofwork.perRequest
     def addSessionToWishlist(self, request):
         """Add session to user's wishlist."""
         user = endpoints.get_current_user()
@@ -867,6 +2320,7 @@ class ConferenceApi(remote.Service):
     @endpoints.method(AddSessionToWishlist, BooleanMessage,
                       path='session/remove_from_wishlist',
                       http_method='DELETE', name='removeSessionFromWishlist')
+    @unitofwork.perRequest
     def removeSessionFromWishlist(self, request):
         """Remove session to user's wishlist."""
         user = endpoints.get_current_user()
@@ -878,6 +2332,7 @@ class ConferenceApi(remote.Service):
     @endpoints.method(message_types.VoidMessage, SessionForms,
                       path='sessions/get_wishlist',
                       http_method='GET', name='getSessionsInWishlist')
+    @unitofwork.perRequest
     def getSessionsInWishlist(self, request):
         """Get list of sessions that user has on their wishlist."""
         user = endpoints.get_current_user()
@@ -885,14 +2340,11 @@ class ConferenceApi(remote.Service):
             raise endpoints.UnauthorizedException('Authorization required')
         # user_id = getUserId(user)
         prof = self._getProfileFromUser()  # get user Profile
-        session_keys = [ndb.Key(urlsafe=wsck) for wsck
-                        in prof.sessionKeysToAttend]
+        session_keys = self._wishlistSessionKeysAsync(prof.key).get_result()
         sessions = ndb.get_multi(session_keys)
 
         # return set of session objects in wishlist
-        return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
-        )
+        return self._copySessionsToForms(sessions)
 
     @endpoints.method(FindSessionByDatewithStartTimeRange, SessionForms,
                       path='session/find_by_date_and_start_time_range',
@@ -905,7 +2357,32 @@ class ConferenceApi(remote.Service):
             raise endpoints.UnauthorizedException('Authorization required')
         # user_id = getUserId(user)
 
-        sessions = Session.query()
+        page_size = request.pageSize or DEFAULT_PAGE_SIZE
+        if page_size < 1 or page_size > MAX_PAGE_SIZE:
+            raise endpoints.BadRequestException(
+                "pageSize must be between 1 and %d." % MAX_PAGE_SIZE)
+
+        # scope the query to one conference when given one
+        c_key = None
+        wsck = request.websafeConferenceKey
+        if wsck:
+            try:
+                c_key = ndb.Key(urlsafe=wsck)
+            except:
+                c_key = None
+            if not c_key or c_key.kind() != Conference._get_kind():
+                raise endpoints.NotFoundException(
+                    'No conference found for key: %s' % wsck)
+
+        cursor = None
+        if request.pageToken:
+            try:
+                cursor = ndb.Cursor(urlsafe=request.pageToken)
+            except:
+                raise endpoints.BadRequestException(
+                    "Invalid pageToken: %s" % request.pageToken)
+
+        sessions = Session.query(ancestor=c_key)
 
         theStartTime = datetime.strptime(
                        request.startTimeRangeBeginning, "%H:%M").time()
@@ -913,13 +2390,21 @@ class ConferenceApi(remote.Service):
                      request.startTimeRangeEnding, "%H:%M").time()
         theDate = datetime.strptime(request.conferenceDate, "%Y-%m-%d").date()
 
+        sessions = sessions.filter(Session.date == theDate)
+        if request.typeOfSession:
+            sessions = sessions.filter(
+                Session.typeOfSession == request.typeOfSession)
         sessions = sessions.filter(Session.startTime >= theStartTime)
         sessions = sessions.filter(Session.startTime <= theEndTime)
-        sessions = sessions.filter(Session.date == theDate)
+        sessions = sessions.order(Session.startTime)
 
-        return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
-        )
+        sessions, next_cursor, more = sessions.fetch_page(
+            page_size, start_cursor=cursor)
+
+        forms = self._copySessionsToForms(sessions)
+        if more and next_cursor:
+            forms.nextPageToken = next_cursor.urlsafe()
+        return forms
 
     @endpoints.method(SessionsBySpeakerOnSpecificDate, SessionForms,
                       path='session/find_by_speaker_on_specific_date',
@@ -934,82 +2419,80 @@ class ConferenceApi(remote.Service):
             raise endpoints.UnauthorizedException('Authorization required')
         # user_id = getUserId(user)
 
-        sp_lastName = request.lastName
-        sp_firstName = request.firstName
         theDate = datetime.strptime(request.conferenceDate, "%Y-%m-%d").date()
 
-        if sp_firstName:
-            # find by first and last name
-            speaker = Speaker.query(ndb.AND(
-                Speaker.lastName == sp_lastName,
-                Speaker.firstName == sp_firstName))
-        else:
-            # find by last name only
-            speaker = Speaker.query(Speaker.lastName == sp_lastName)
-
-        speaker_keys = [sp.key for sp in speaker]
-
-        # iterate over each key finding all sessions
-        all_sessions = []
-        for sp_k in speaker_keys:
-            sessions = Session.query(ndb.AND(
-                Session.speaker == sp_k,
-                Session.date == theDate))
-            for s in sessions:
-                all_sessions.append(s)
+        all_sessions = self._sessionsBySpeakerAsync(
+            request.lastName, request.firstName, theDate,
+            limit=request.limit).get_result()
 
         # return list of sessions that match each of the speaker_keys
-        return SessionForms(
-            items=[self._copySessionToForm(sess) for sess in all_sessions]
-        )
+        return self._copySessionsToForms(all_sessions)
 
-    @endpoints.method(message_types.VoidMessage, SessionForms,
+    @endpoints.method(SESSION_PAGE_REQUEST, SessionForms,
                       path='session/nonWorkshop_Sessions_Before_7pm',
                       http_method='GET', name='NonWorkshopSessionsBefore7pm')
     def NonWorkshopSessionsBefore7pm(self, request):
-        """Return Non-Workshop Sessions Before 7pm."""
+        """Return Non-Workshop Sessions Before 7pm, one page at a time."""
         # make sure user is authed
         user = endpoints.get_current_user()
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
         # user_id = getUserId(user)
+        page_size, cursor = self._pageRequest(request)
 
         theStartTime = datetime.strptime("19:00", "%H:%M").time()
 
-        # idea from reading answers from Tim Hoffman
-        # (http://stackoverflow.com/users/1201324/tim-hoffman)
-        # and Brent Washburne
-        # (http://stackoverflow.com/users/584846/brent-washburne)
-        # specifically Brent's answer here:
-        # https://stackoverflow.com/questions/33549573/combining-results-of-multiple-ndb-inequality-queries
-
-        # create two separate inequality queries and get the keys from each
-        # then use set.intersection method to get the
-        # intersection of the two sets
-        query1 = Session.query(Session.typeOfSession != "Workshop").fetch(
-                               keys_only=True)
-        query2 = Session.query(Session.startTime < theStartTime).fetch(
-                               keys_only=True)
-        sessions = ndb.get_multi(set(query1).intersection(query2))
+        # "not a workshop" is stored as the isWorkshop flag, leaving
+        # startTime as the only inequality: one indexed scan
+        sessions, next_cursor, more = self._sessionsBefore(
+            theStartTime, page_size, cursor, isWorkshop=False)
 
         # return set of SessionForm objects per Conference
-        return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
-        )
+        forms = self._copySessionsToForms(sessions)
+        if more and next_cursor:
+            forms.nextPageToken = next_cursor.urlsafe()
+        return forms
+
+    @endpoints.method(CONF_SESSION_PAGE_REQUEST, SessionForms,
+                      path='conference/{websafeConferenceKey}/'
+                           'nonWorkshop_Sessions_Before_7pm',
+                      http_method='GET',
+                      name='getConferenceNonWorkshopSessionsBefore7pm')
+    def getConferenceNonWorkshopSessionsBefore7pm(self, request):
+        """Return a Conference's Non-Workshop Sessions Before 7pm, one
+        page at a time."""
+        # make sure user is authed
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        page_size, cursor = self._pageRequest(request)
+
+        wsck = request.websafeConferenceKey
+        try:
+            c_key = ndb.Key(urlsafe=wsck)
+        except:
+            c_key = None
+        if not c_key or c_key.kind() != Conference._get_kind():
+            raise endpoints.NotFoundException(
+                'No conference found for key: %s' % wsck)
+
+        theStartTime = datetime.strptime("19:00", "%H:%M").time()
+        sessions, next_cursor, more = self._sessionsBefore(
+            theStartTime, page_size, cursor, isWorkshop=False,
+            ancestor=c_key)
+
+        # return set of SessionForm objects for conference
+        forms = self._copySessionsToForms(sessions)
+        if more and next_cursor:
+            forms.nextPageToken = next_cursor.urlsafe()
+        return forms
 
 
 # - - - Speaker - - - - - - - - - - - - - - - - - - - -
 
     def _copySpeakerToForm(self, speak):
         """Copy relevant fields from Speaker to SpeakerForm."""
-        sp = SpeakerForm()
-        for field in sp.all_fields():
-            if hasattr(speak, field.name):
-                setattr(sp, field.name, getattr(speak, field.name))
-            elif field.name == "speakerWebSafeKey":
-                setattr(sp, field.name, speak.key.urlsafe())
-        sp.check_initialized()
-        return sp
+        return self._applyFormPlan(SPEAKER_FORM_PLAN, SpeakerForm, speak)
 
     def _createSpeakerObject(self, request):
         """Create a Speaker object."""
@@ -1039,16 +2522,64 @@ class ConferenceApi(remote.Service):
         del data['speakerWebSafeKey']
 
         # creation Speaker entity
-        Speaker(**data).put()
+        unitofwork.put(Speaker(**data))
 
         return request
 
+    def _updateSpeakerObject(self, request):
+        """Update a Speaker and rebuild the agendas of the Conferences
+        it speaks at."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        user_id = getUserId(user)
+
+        try:
+            sp_key = ndb.Key(urlsafe=request.websafeSpeakerKey)
+        except:
+            sp_key = None
+        speaker = unitofwork.track(sp_key.get()) if sp_key and \
+            sp_key.kind() == Speaker._get_kind() else None
+        if not speaker:
+            raise endpoints.NotFoundException(
+                'No speaker found for key: %s' % request.websafeSpeakerKey)
+
+        # check that user is owner
+        if user_id != sp_key.parent().id():
+            raise endpoints.ForbiddenException(
+                'Only the owner can update the speaker.')
+
+        # only copy fields where we get data
+        for field in request.all_fields():
+            if field.name in ('speakerWebSafeKey', 'websafeSpeakerKey'):
+                continue
+            data = getattr(request, field.name)
+            if data not in (None, []):
+                setattr(speaker, field.name, data)
+        unitofwork.put(speaker)
+
+        # speaker names are embedded in the agendas of their conferences
+        session_keys = Session.query(
+            Session.speaker == sp_key).fetch(keys_only=True)
+        unitofwork.afterFlush(lambda: self._enqueueAgendaRebuilds(
+            s_key.parent().urlsafe() for s_key in session_keys))
+        return self._copySpeakerToForm(speaker)
+
     @endpoints.method(SpeakerForm, SpeakerForm, path='speaker/create_speaker',
                       http_method='POST', name='createSpeaker')
+    @unitofwork.perRequest
     def createSpeaker(self, request):
         """Create new speaker."""
         return self._createSpeakerObject(request)
 
+    @endpoints.method(SPEAKER_POST_REQUEST, SpeakerForm,
+                      path='speaker/{websafeSpeakerKey}',
+                      http_method='PUT', name='updateSpeaker')
+    @unitofwork.perRequest
+    def updateSpeaker(self, request):
+        """Update speaker w/provided fields & return w/updated info."""
+        return self._updateSpeakerObject(request)
+
     @endpoints.method(message_types.VoidMessage, SpeakerForms,
                       path='speaker/speakers',
                       http_method='GET', name='getSpeakersCreated')
@@ -1069,4 +2600,404 @@ class ConferenceApi(remote.Service):
         )
 
 
+# - - - Search - - - - - - - - - - - - - - - - - - - - - -
+
+    @endpoints.method(SearchForm, SearchResults, path='search',
+                      http_method='GET', name='search')
+    def fullTextSearch(self, request):
+        """Full-text search of Conference & Session names, descriptions,
+        topics & highlights, best matches first; end a word with '*' to
+        match it as a prefix."""
+        page_size = request.pageSize or DEFAULT_PAGE_SIZE
+        if page_size < 1 or page_size > MAX_PAGE_SIZE:
+            raise endpoints.BadRequestException(
+                "pageSize must be between 1 and %d." % MAX_PAGE_SIZE)
+        # rankings aren't in index order, so pages are offsets into them
+        try:
+            offset = int(request.pageToken or 0)
+        except ValueError:
+            offset = -1
+        if offset < 0:
+            raise endpoints.BadRequestException(
+                "Invalid pageToken: %s" % request.pageToken)
+
+        try:
+            ranked = search.search(request.query, request.kind)
+        except ValueError as e:
+            raise endpoints.BadRequestException(str(e))
+
+        page = ranked[offset:offset + page_size]
+        more = offset + page_size < len(ranked)
+        return SearchResults(
+            items=[SearchResult(kind=kind, websafeKey=wsk, name=title,
+                                score=score)
+                   for score, kind, wsk, title in page],
+            nextPageToken=str(offset + page_size) if more else None,
+            total=len(ranked))
+
+
+# - - - Bulk import - - - - - - - - - - - - - - - - - - - -
+
+    @staticmethod
+    def _readImportRecords(stream, fmt='jsonl'):
+        """Yield (line number, record) for each record of a JSONL or CSV
+        import stream; record is None if the line can't be parsed.
+        """
+        if fmt == 'csv':
+            # header row names the fields; list fields are '|' separated
+            for lineno, row in enumerate(csv.DictReader(stream), 2):
+                record = {}
+                for name, value in row.items():
+                    if not name or not value:
+                        continue
+                    value = value.decode('utf-8')
+                    if name in IMPORT_LIST_FIELDS:
+                        value = value.split(IMPORT_LIST_SEPARATOR)
+                    record[name] = value
+                yield lineno, record
+        else:
+            for lineno, line in enumerate(stream, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = None
+                yield lineno, (record if isinstance(record, dict) else None)
+
+    @staticmethod
+    def _formFromRecord(form_cls, record):
+        """Copy the fields of an import record into a form message,
+        converting CSV strings to integers where needed."""
+        form = form_cls()
+        for field in form.all_fields():
+            value = record.get(field.name)
+            if value in (None, '', []):
+                continue
+            if field.repeated and not isinstance(value, list):
+                value = [value]
+            if isinstance(field, messages.IntegerField):
+                value = ([int(v) for v in value] if field.repeated
+                         else int(value))
+            setattr(form, field.name, value)
+        form.check_initialized()
+        return form
+
+    @staticmethod
+    def _resolveImportKey(state, record, ref_field, wsk_field, model):
+        """Return the key an import record refers to, either by the 'ref'
+        of a record imported earlier or by websafe key of an existing
+        entity owned by the importing user."""
+        ref = record.get(ref_field)
+        if ref:
+            key = state['refs'].get(ref)
+            if not key or key.kind() != model._get_kind():
+                raise ValueError('Unknown %s ref: %s' % (ref_field, ref))
+            return key
+
+        wsk = record.get(wsk_field)
+        try:
+            key = ndb.Key(urlsafe=wsk)
+        except:
+            key = None
+        if not key or key.kind() != model._get_kind():
+            raise ValueError('No %s found for key: %s' % (ref_field, wsk))
+        if key.parent() != state['profile'].key:
+            raise ValueError('Only the %s owner can use this %s.'
+                             % (ref_field, ref_field))
+        state['external'].add(key)
+        return key
+
+    @staticmethod
+    def _putImported(entities):
+        """Write imported entities in chunked put_multi calls."""
+        futures = []
+        for i in range(0, len(entities), IMPORT_PUT_CHUNK):
+            futures.extend(ndb.put_multi_async(
+                entities[i:i + IMPORT_PUT_CHUNK], use_cache=False))
+        for future in futures:
+            future.get_result()
+
+    @staticmethod
+    @ndb.transactional()
+    def _putImportedSessions(c_key, sessions):
+        """Write those of a Conference's imported Sessions that an earlier
+        try didn't, with their search documents, and count them into its
+        SpeakerStats in the same transaction; returns them.
+        """
+        found = ndb.get_multi([sess.key for sess in sessions])
+        added = [sess for sess, old in zip(sessions, found) if not old]
+        if added:
+            ndb.put_multi(added +
+                          [search.documentFor(sess) for sess in added] +
+                          [ConferenceApi._countSpeakerSessions(c_key, added)])
+        return added
+
+    @staticmethod
+    def _importBatch(batch, state):
+        """Create the Speakers, Conferences and Sessions of one batch of
+        import records. Keys are named after the import job and line, so
+        a retried batch skips the records it already wrote."""
+        p_key = state['profile'].key
+        errors = state['errors']
+
+        def keyName(lineno):
+            return '%s-%d' % (state['keyPrefix'], lineno)
+
+        # validate and convert every record before allocating ids
+        speakers, confs, sessions = [], [], []
+        for lineno, record in batch:
+            kind = (record or {}).get('kind')
+            try:
+                if kind == 'Speaker':
+                    form = ConferenceApi._formFromRecord(SpeakerForm, record)
+                    if not form.firstName or not form.lastName:
+                        raise ValueError("Speaker 'firstName' and "
+                                         "'lastName' fields required")
+                    data = {field.name: getattr(form, field.name)
+                            for field in form.all_fields()}
+                    del data['speakerWebSafeKey']
+                    speakers.append((lineno, record, data))
+                elif kind == 'Conference':
+                    form = ConferenceApi._formFromRecord(
+                        ConferenceForm, record)
+                    if not form.name:
+                        raise ValueError("Conference 'name' field required")
+                    confs.append((lineno, record,
+                                  ConferenceApi._conferenceData(form)))
+                elif kind == 'Session':
+                    form = ConferenceApi._formFromRecord(SessionForm, record)
+                    sessions.append(
+                        (lineno, record, ConferenceApi._sessionData(form)))
+                else:
+                    raise ValueError('Unknown kind: %s' % kind)
+            except (ValueError, TypeError, messages.ValidationError) as e:
+                errors.append('line %d: %s' % (lineno, e))
+
+        # leave out the Speakers and Conferences an earlier try wrote
+        sp_keys = [ndb.Key(Speaker, keyName(lineno), parent=p_key)
+                   for lineno, record, data in speakers]
+        conf_keys = [ndb.Key(Conference, keyName(lineno), parent=p_key)
+                     for lineno, record, data in confs]
+        written = set(entity.key for entity in
+                      ndb.get_multi(sp_keys + conf_keys) if entity)
+
+        entities = []
+        for key, (lineno, record, data) in zip(sp_keys, speakers):
+            if key not in written:
+                data['key'] = key
+                entities.append(Speaker(**data))
+            if record.get('ref'):
+                state['refs'][record['ref']] = key
+
+        gen_keys = set()
+        new_confs = []
+        for c_key, (lineno, record, data) in zip(conf_keys, confs):
+            if c_key not in written:
+                data['key'] = c_key
+                data['organizerUserId'] = p_key.id()
+                data['organizerDisplayName'] = \
+                    state['profile'].displayName or ''
+                conf = Conference(**data)
+                new_confs.append(conf)
+                entities.append(search.documentFor(conf))
+                entities.extend(SeatShard(key=k, seats=n) for k, n in zip(
+                    ConferenceApi._seatShardKeys(c_key),
+                    ConferenceApi._splitSeats(data['seatsAvailable'])))
+                gen_keys.update(ConferenceApi._conferenceGenerationKeys(conf))
+            if record.get('ref'):
+                state['refs'][record['ref']] = c_key
+        state['counts']['Speaker'] += len(speakers)
+        state['counts']['Conference'] += len(confs)
+
+        # resolve session references, checking that existing entities
+        # named by websafe key are there with one get_multi
+        resolved = []
+        for lineno, record, data in sessions:
+            try:
+                data['speaker'] = ConferenceApi._resolveImportKey(
+                    state, record, 'speaker', 'speakerWebSafeKey', Speaker)
+                c_key = ConferenceApi._resolveImportKey(
+                    state, record, 'conference', 'conferenceWebSafeKey',
+                    Conference)
+            except ValueError as e:
+                errors.append('line %d: %s' % (lineno, e))
+                continue
+            resolved.append((lineno, c_key, data))
+
+        unchecked = list(state['external'] - state['checked'])
+        for key, entity in zip(unchecked, ndb.get_multi(unchecked)):
+            if entity:
+                state['checked'].add(key)
+            else:
+                state['missing'].add(key)
+        by_conf = {}
+        for lineno, c_key, data in resolved:
+            missing = [k for k in (c_key, data['speaker'])
+                       if k in state['missing']]
+            if missing:
+                errors.append('line %d: No %s found for key: %s' % (
+                    lineno, missing[0].kind().lower(), missing[0].urlsafe()))
+                continue
+            data['key'] = ndb.Key(Session, keyName(lineno), parent=c_key)
+            by_conf.setdefault(c_key, []).append(Session(**data))
+
+        # a Conference is written after its seat shards and search
+        # document, so one found by a retry is complete
+        ConferenceApi._putImported(entities)
+        ConferenceApi._putImported(new_confs)
+
+        # sessions are written with their speaker counts, so a retry
+        # counts only those it adds
+        for c_key, new_sessions in by_conf.items():
+            for i in range(0, len(new_sessions), IMPORT_SESSION_TXN_SIZE):
+                ConferenceApi._putImportedSessions(
+                    c_key, new_sessions[i:i + IMPORT_SESSION_TXN_SIZE])
+            state['featured'].add(c_key.urlsafe())
+            state['counts']['Session'] += len(new_sessions)
+        if gen_keys:
+            ConferenceApi._invalidateQueryCache(gen_keys)
+        for conf in new_confs:
+            if ConferenceApi._nearlySoldOut(conf.seatsAvailable):
+                ConferenceApi._updateAnnouncement(
+                    conf.key.urlsafe(), conf.name, conf.seatsAvailable)
+
+    @staticmethod
+    def _startImport(user_id, stream, fmt='jsonl'):
+        """Store a JSONL or CSV stream of Speakers, Conferences and
+        Sessions for a user as chunks of at most IMPORT_BATCH_SIZE
+        parsed records, and enqueue the task importing the first; used
+        by import handler. Returns the job's progress.
+        """
+        p_key = ndb.Key(Profile, user_id)
+        if not p_key.get():
+            raise endpoints.NotFoundException(
+                'No profile found for user: %s' % user_id)
+        if fmt not in ('jsonl', 'csv'):
+            raise endpoints.BadRequestException(
+                'Unknown import format: %s' % fmt)
+
+        # parsing is quick; the writes are left to the tasks
+        chunks, lines, size = [], [], 0
+        records = 0
+        for lineno, record in ConferenceApi._readImportRecords(stream, fmt):
+            line = json.dumps([lineno, record], separators=(',', ':'))
+            if lines and (len(lines) >= IMPORT_BATCH_SIZE or
+                          size + len(line) > IMPORT_CHUNK_BYTES):
+                chunks.append('\n'.join(lines))
+                lines, size = [], 0
+            lines.append(line)
+            size += len(line) + 1
+            records += 1
+        if lines:
+            chunks.append('\n'.join(lines))
+
+        job_id = ImportJob.allocate_ids(size=1, parent=p_key)[0]
+        job = ImportJob(key=ndb.Key(ImportJob, job_id, parent=p_key),
+                        chunks=len(chunks), records=records,
+                        counts={'Speaker': 0, 'Conference': 0,
+                                'Session': 0},
+                        refs={}, errors=[], done=not chunks)
+        ConferenceApi._putImported(
+            [ImportChunk(key=ndb.Key(ImportChunk, i + 1, parent=job.key),
+                         data=data)
+             for i, data in enumerate(chunks)] + [job])
+        if chunks:
+            ConferenceApi._enqueueImport(job)
+        return ConferenceApi._importProgress(job)
+
+    @staticmethod
+    def _enqueueImport(job):
+        """Chain the task importing the job's next chunk; named by chunk
+        so a retried task doesn't start a second chain."""
+        try:
+            taskqueue.add(params={'websafeJobKey': job.key.urlsafe()},
+                          url='/tasks/import',
+                          name='import-%d-%d' % (job.key.id(), job.offset))
+        except (taskqueue.TaskAlreadyExistsError,
+                taskqueue.TombstonedTaskError):
+            pass
+
+    @staticmethod
+    def _runImport(wsjk):
+        """Import the next chunk of an import job, save its progress and
+        chain the task for the chunk after; used by import task. A chunk
+        that fails part way is retried, skipping what it already wrote.
+        """
+        job = ndb.Key(urlsafe=wsjk).get()
+        if not job or job.done:
+            return job
+        prof = job.key.parent().get()
+        chunk = ndb.Key(ImportChunk, job.offset + 1, parent=job.key).get()
+
+        state = {'profile': prof,
+                 'keyPrefix': 'import-%d' % job.key.id(),
+                 'refs': dict((ref, ndb.Key(urlsafe=wsk))
+                              for ref, wsk in job.refs.items()),
+                 'external': set(),
+                 'checked': set(),
+                 'missing': set(),
+                 'featured': set(),
+                 'counts': Counter(job.counts),
+                 'errors': []}
+        batch = [tuple(json.loads(line))
+                 for line in chunk.data.split('\n')] if chunk else []
+        if prof and batch:
+            ConferenceApi._importBatch(batch, state)
+        elif batch:
+            state['errors'].append('No profile found for user: %s'
+                                   % job.key.parent().id())
+
+        # recompute featured speaker once per conference given sessions
+        for wsck in sorted(state['featured']):
+            ConferenceApi._scheduleFeaturedSpeaker(wsck)
+        ConferenceApi._enqueueAgendaRebuilds(state['featured'])
+
+        job.offset += 1
+        job.done = job.offset >= job.chunks or not prof
+        job.counts = dict(state['counts'])
+        job.refs = dict((ref, key.urlsafe())
+                        for ref, key in state['refs'].items())
+        job.errors = (job.errors + state['errors'])[:IMPORT_MAX_ERRORS]
+        job.failed += len(state['errors'])
+        job.put()
+        logging.info('import %s: chunk %d of %d done, %s, %d failed',
+                     wsjk, job.offset, job.chunks,
+                     ', '.join('%d %s' % (n, kind) for kind, n in
+                               sorted(job.counts.items())), job.failed)
+        if not job.done:
+            ConferenceApi._enqueueImport(job)
+        return job
+
+    @staticmethod
+    def _importProgress(job):
+        """Return a summary of an import job's progress."""
+        return {'job': job.key.urlsafe(),
+                'done': job.done,
+                'chunks': job.chunks,
+                'chunksDone': job.offset,
+                'records': job.records,
+                'speakers': job.counts['Speaker'],
+                'conferences': job.counts['Conference'],
+                'sessions': job.counts['Session'],
+                'refs': job.refs,
+                'failed': job.failed,
+                'errors': job.errors}
+
+    @staticmethod
+    def _getImportProgress(user_id, wsjk):
+        """Return the progress of one of the user's import jobs; used by
+        import handler."""
+        try:
+            j_key = ndb.Key(urlsafe=wsjk)
+        except:
+            j_key = None
+        job = (j_key.get() if j_key and j_key.kind() == ImportJob._get_kind()
+               and j_key.parent() == ndb.Key(Profile, user_id) else None)
+        if not job:
+            raise endpoints.NotFoundException(
+                'No import job found for key: %s' % wsjk)
+        return ConferenceApi._importProgress(job)
+
+
 api = endpoints.api_server([ConferenceApi])  # register API
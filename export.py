@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+
+"""
+export.py -- Udacity conference server-side Python App Engine
+    resumable JSONL export of Conference, Session, Speaker & Profile data
+
+$Id$
+
+"""
+
+from datetime import date
+from datetime import datetime
+from datetime import time
+import json
+import os
+import re
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import ExportJob
+from models import ExportPage
+
+EXPORT_KINDS = ('Conference', 'Session', 'Speaker', 'Profile',
+                'Registration', 'WishlistEntry')
+EXPORT_PAGE_SIZE = 500
+# pages stay well below the 1MB entity limit however large the entities
+EXPORT_PAGE_BYTES = 512 * 1024
+EXPORT_PAGES_PER_TASK = 20
+EXPORT_DIR = 'exports'
+# job ids go into task names, which take at most 500 of these characters
+EXPORT_JOB_ID = re.compile(r'^[a-zA-Z0-9_-]{1,450}$')
+
+
+# - - - Sinks - - - - - - - - - - - - - - - - - - - - - - - -
+
+class DatastoreSink(object):
+    """Store each page as an ExportPage entity under the job; stands in
+    for a blob store."""
+
+    def __init__(self, job_key):
+        self.job_key = job_key
+
+    def write(self, kind, page, lines):
+        """Write one page of JSONL lines; rewriting a page replaces it."""
+        ExportPage(id='%s-%06d' % (kind, page), parent=self.job_key,
+                   exportKind=kind, page=page,
+                   data='\n'.join(lines) + '\n').put()
+
+
+class LocalFileSink(object):
+    """Write each page to EXPORT_DIR/<job>/<kind>-<page>.jsonl; for the
+    development server."""
+
+    def __init__(self, job_key):
+        self.path = os.path.join(EXPORT_DIR, str(job_key.id()))
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+    def write(self, kind, page, lines):
+        """Write one page of JSONL lines; rewriting a page replaces it."""
+        with open(os.path.join(self.path, '%s-%06d.jsonl' % (kind, page)),
+                  'w') as f:
+            for line in lines:
+                f.write(line + '\n')
+
+
+SINKS = {
+    'datastore': DatastoreSink,
+    'file': LocalFileSink,
+}
+
+
+# - - - Serialization - - - - - - - - - - - - - - - - - - - -
+
+def _jsonValue(value):
+    """Convert a property value to something json can encode."""
+    if isinstance(value, ndb.Key):
+        return value.urlsafe()
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, list):
+        return [_jsonValue(v) for v in value]
+    return value
+
+
+def entityToJson(entity):
+    """Return one JSONL line for an entity, with its kind and key."""
+    data = dict((name, _jsonValue(value))
+                for name, value in entity.to_dict().items())
+    data['kind'] = entity.key.kind()
+    data['key'] = entity.key.urlsafe()
+    return json.dumps(data, sort_keys=True)
+
+
+# - - - Jobs - - - - - - - - - - - - - - - - - - - - - - - -
+
+def startExport(job_id, sink='datastore'):
+    """Create export job job_id (unless it already exists) and enqueue
+    its first task; returns the ExportJob."""
+    if not EXPORT_JOB_ID.match(job_id):
+        raise ValueError('Invalid export job id: %s' % job_id)
+    if sink not in SINKS:
+        raise ValueError('Unknown export sink: %s' % sink)
+    job = ExportJob.get_or_insert(job_id, sink=sink,
+                                  kinds=list(EXPORT_KINDS))
+    if not job.done:
+        _enqueueExport(job)
+    return job
+
+
+def _enqueueExport(job):
+    """Chain the next export task; named by step so a retried task
+    doesn't start a second chain."""
+    try:
+        taskqueue.add(params={'jobId': job.key.id()},
+                      url='/tasks/export',
+                      name='export-%s-%d' % (job.key.id(), job.step))
+    except (taskqueue.TaskAlreadyExistsError,
+            taskqueue.TombstonedTaskError):
+        pass
+
+
+def runExport(job_id):
+    """Export up to EXPORT_PAGES_PER_TASK pages, saving the cursor after
+    each so a failed task resumes where it stopped, then chain the next
+    task; used by export task. A page holds up to EXPORT_PAGE_SIZE
+    entities and EXPORT_PAGE_BYTES of JSONL."""
+    job = ExportJob.get_by_id(job_id)
+    if not job or job.done:
+        return job
+    sink = SINKS[job.sink](job.key)
+
+    for _ in range(EXPORT_PAGES_PER_TASK):
+        if not job.kinds:
+            break
+        kind = job.kinds[0]
+        cursor = ndb.Cursor(urlsafe=job.cursor) if job.cursor else None
+        it = ndb.Query(kind=kind).iter(
+            start_cursor=cursor, produce_cursors=True,
+            batch_size=EXPORT_PAGE_SIZE + 1,   # one more to see if it's last
+            use_cache=False, use_memcache=False)
+        lines = []
+        size = 0
+        more = False
+        for entity in it:
+            line = entityToJson(entity)
+            if lines and (len(lines) >= EXPORT_PAGE_SIZE or
+                          size + len(line) + 1 > EXPORT_PAGE_BYTES):
+                # this entity starts the next page
+                next_cursor = it.cursor_before()
+                more = True
+                break
+            lines.append(line)
+            size += len(line) + 1
+
+        if lines:
+            sink.write(kind, job.page, lines)
+            job.exported += len(lines)
+
+        # move on to the next page, or the next kind
+        if more and next_cursor:
+            job.cursor = next_cursor.urlsafe()
+            job.page += 1
+        else:
+            job.kinds.pop(0)
+            job.cursor = None
+            job.page = 0
+        job.put()
+
+    if job.kinds:
+        job.step += 1
+        job.put()
+        _enqueueExport(job)
+    else:
+        job.done = True
+        job.put()
+    return job
@@ -10,10 +10,19 @@ created by wesc on 2014 may 24
 
 """
 
+from datetime import datetime
+import json
+
+import endpoints
 import webapp2
 from google.appengine.api import app_identity
 from google.appengine.api import mail
+from google.appengine.api import users
 from conference import ConferenceApi
+import export
+import notify
+import search
+from utils import getUserId
 
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
@@ -25,18 +34,147 @@ class SetAnnouncementHandler(webapp2.RequestHandler):
         self.response.set_status(204)
 
 
+class StartExportHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start the nightly export (one job per day)."""
+        job_id = self.request.get('jobId') or \
+            datetime.utcnow().strftime('%Y%m%d')
+        try:
+            export.startExport(job_id, self.request.get('sink', 'datastore'))
+        except ValueError as e:
+            self.abort(400, detail=str(e))
+        self.response.set_status(204)
+
+
+class ExportHandler(webapp2.RequestHandler):
+    def post(self):
+        """Export the next pages of a job and chain the next task."""
+        export.runExport(self.request.get('jobId'))
+        self.response.set_status(204)
+
+
 class SetFeaturedSpeaker(webapp2.RequestHandler):
     def get(self):
         """Set Featured Speaker in Memcache."""
         ConferenceApi._setFeaturedSpeaker(
-            self.request.get('websafeConferenceKey'),
-            self.request.get('websafeSpeakerKey'))
+            self.request.get('websafeConferenceKey'))
+        self.response.set_status(204)
+
+
+class RebuildAgendaHandler(webapp2.RequestHandler):
+    def post(self):
+        """Rebuild a Conference's agenda document."""
+        try:
+            ConferenceApi()._buildAgenda(
+                self.request.get('websafeConferenceKey'))
+        except endpoints.NotFoundException:
+            pass    # conference is gone; nothing to rebuild
+        self.response.set_status(204)
+
+
+class AggregateSeatsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Total Conference seat shards into seatsAvailable."""
+        ConferenceApi._aggregateSeats(
+            self.request.get('websafeConferenceKey'))
+        self.response.set_status(204)
+
+
+class RefreshOrganizerNameHandler(webapp2.RequestHandler):
+    def post(self):
+        """Copy organizer's display name onto their Conferences."""
+        ConferenceApi._refreshOrganizerDisplayName(self.request.get('userId'))
+        self.response.set_status(204)
+
+
+class BackfillProfilesHandler(webapp2.RequestHandler):
+    def get(self):
+        """Move Profile registrations/wishlists into their own entities."""
+        ConferenceApi._backfillProfiles(self.request.get('cursor'))
+        self.response.set_status(204)
+
+
+class BackfillOrganizerNamesHandler(webapp2.RequestHandler):
+    def get(self):
+        """Copy organizers' display names onto existing Conferences."""
+        ConferenceApi._backfillOrganizerNames(self.request.get('cursor'))
+        self.response.set_status(204)
+
+
+class ImportHandler(webapp2.RequestHandler):
+    def post(self):
+        """Start a bulk import of Speakers, Conferences and Sessions from
+        the JSONL (or ?format=csv) request body."""
+        user = users.get_current_user()
+        if not user:
+            self.abort(401)
+        try:
+            progress = ConferenceApi._startImport(
+                getUserId(user), self.request.body_file,
+                self.request.get('format', 'jsonl'))
+        except endpoints.BadRequestException as e:
+            self.abort(400, detail=str(e))
+        except endpoints.NotFoundException as e:
+            self.abort(404, detail=str(e))
+        self.response.set_status(202)
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(progress))
+
+    def get(self):
+        """Report the progress of a bulk import (?job=)."""
+        user = users.get_current_user()
+        if not user:
+            self.abort(401)
+        try:
+            progress = ConferenceApi._getImportProgress(
+                getUserId(user), self.request.get('job'))
+        except endpoints.NotFoundException as e:
+            self.abort(404, detail=str(e))
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(progress))
+
+
+class ImportTaskHandler(webapp2.RequestHandler):
+    def post(self):
+        """Import the next chunk of a bulk import and chain the next."""
+        ConferenceApi._runImport(self.request.get('websafeJobKey'))
+        self.response.set_status(204)
+
+
+class BackfillSessionsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Store computed Session properties on existing Sessions."""
+        ConferenceApi._backfillSessions(self.request.get('cursor'))
+        self.response.set_status(204)
+
+
+class BackfillSearchHandler(webapp2.RequestHandler):
+    def get(self):
+        """Index existing Conferences and Sessions for search."""
+        kinds = ([self.request.get('kind')] if self.request.get('kind')
+                 else sorted(search.SEARCH_FIELDS))
+        try:
+            for kind in kinds:
+                search.reindex(kind, self.request.get('cursor'))
+        except ValueError as e:
+            self.abort(400, detail=str(e))
+        self.response.set_status(204)
+
+
+class SendNotificationsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Send queued notifications as one digest per recipient."""
+        try:
+            notify.sendNotifications(self.request.get('transport', 'mail'))
+        except ValueError as e:
+            self.abort(400, detail=str(e))
         self.response.set_status(204)
 
 
 class SendConfirmationEmailHandler(webapp2.RequestHandler):
     def post(self):
-        """Send email confirming Conference creation."""
+        """Send email confirming Conference creation; only drains tasks
+        queued before notifications were batched (see notify.py)."""
         mail.send_mail(
             'noreply@%s.appspotmail.com' % (
                 app_identity.get_application_id()),     # from
@@ -50,6 +188,18 @@ class SendConfirmationEmailHandler(webapp2.RequestHandler):
 
 app = webapp2.WSGIApplication([
     ('/crons/set_announcement', SetAnnouncementHandler),
+    ('/crons/export', StartExportHandler),
+    ('/crons/send_notifications', SendNotificationsHandler),
+    ('/tasks/export', ExportHandler),
     ('/tasks/set_featured_speaker', SetFeaturedSpeaker),
+    ('/tasks/refresh_organizer_name', RefreshOrganizerNameHandler),
+    ('/tasks/aggregate_seats', AggregateSeatsHandler),
+    ('/tasks/rebuild_agenda', RebuildAgendaHandler),
+    ('/tasks/backfill_profiles', BackfillProfilesHandler),
+    ('/tasks/backfill_organizer_names', BackfillOrganizerNamesHandler),
+    ('/tasks/backfill_sessions', BackfillSessionsHandler),
+    ('/tasks/backfill_search', BackfillSearchHandler),
     ('/tasks/send_confirmation_email', SendConfirmationEmailHandler),
+    ('/tasks/import', ImportTaskHandler),
+    ('/import', ImportHandler),
 ], debug=True)
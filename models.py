@@ -28,10 +28,17 @@ class Profile(ndb.Model):
     displayName = ndb.StringProperty()
     mainEmail = ndb.StringProperty()
     teeShirtSize = ndb.StringProperty(default='NOT_SPECIFIED')
+    # legacy; moved into Registration/WishlistEntry by backfill
     conferenceKeysToAttend = ndb.StringProperty(repeated=True)
     sessionKeysToAttend = ndb.StringProperty(repeated=True)
 
 
+class UserEmail(ndb.Model):
+    """UserEmail -- maps a user's email (the key name) to the user id
+    their Profile is keyed by"""
+    userId = ndb.StringProperty(indexed=False)
+
+
 class ProfileMiniForm(messages.Message):
     """ProfileMiniForm -- update Profile form message"""
     displayName = messages.StringField(1)
@@ -45,6 +52,8 @@ class ProfileForm(messages.Message):
     teeShirtSize = messages.EnumField('TeeShirtSize', 3)
     conferenceKeysToAttend = messages.StringField(4, repeated=True)
     sessionKeysToAttend = messages.StringField(5, repeated=True)
+    etag = messages.StringField(6)
+    notModified = messages.BooleanField(7)
 
 
 class StringMessage(messages.Message):
@@ -62,6 +71,7 @@ class Conference(ndb.Model):
     name = ndb.StringProperty(required=True)
     description = ndb.StringProperty()
     organizerUserId = ndb.StringProperty()
+    organizerDisplayName = ndb.StringProperty(indexed=False)
     topics = ndb.StringProperty(repeated=True)
     city = ndb.StringProperty()
     startDate = ndb.DateProperty()
@@ -71,6 +81,11 @@ class Conference(ndb.Model):
     seatsAvailable = ndb.IntegerProperty()
 
 
+class SeatShard(ndb.Model):
+    """SeatShard -- one slice of a Conference's available seats"""
+    seats = ndb.IntegerProperty(default=0, indexed=False)
+
+
 class ConferenceForm(messages.Message):
     """ConferenceForm -- Conference outbound form message"""
     name = messages.StringField(1)
@@ -85,11 +100,36 @@ class ConferenceForm(messages.Message):
     endDate = messages.StringField(10)  # DateTimeField()
     websafeKey = messages.StringField(11)
     organizerDisplayName = messages.StringField(12)
+    etag = messages.StringField(13)
+    notModified = messages.BooleanField(14)
 
 
 class ConferenceForms(messages.Message):
     """ConferenceForms -- multiple Conference outbound form message"""
     items = messages.MessageField(ConferenceForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+    explain = messages.StringField(3)
+
+
+class ConferenceRegistrationForm(messages.Message):
+    """ConferenceRegistrationForm -- batch registration inbound form
+    message"""
+    websafeConferenceKeys = messages.StringField(1, repeated=True)
+
+
+class ConferenceRegistrationResult(messages.Message):
+    """ConferenceRegistrationResult -- registration outcome for one
+    Conference outbound form message"""
+    websafeConferenceKey = messages.StringField(1)
+    registered = messages.BooleanField(2)
+    error = messages.StringField(3)
+
+
+class ConferenceRegistrationResults(messages.Message):
+    """ConferenceRegistrationResults -- multiple
+    ConferenceRegistrationResult outbound form message"""
+    items = messages.MessageField(ConferenceRegistrationResult, 1,
+                                  repeated=True)
 
 
 class TeeShirtSize(messages.Enum):
@@ -122,6 +162,15 @@ class ConferenceQueryForms(messages.Message):
     """ConferenceQueryForms -- multiple
     ConferenceQueryForm inbound form message"""
     filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    pageSize = messages.IntegerField(2)
+    pageToken = messages.StringField(3)
+    explain = messages.BooleanField(4)
+    fields = messages.StringField(5, repeated=True)
+
+
+class ConferenceFieldsForm(messages.Message):
+    """ConferenceFieldsForm -- ConferenceForm fields wanted in a list"""
+    fields = messages.StringField(1, repeated=True)
 
 
 class Speaker(ndb.Model):
@@ -143,6 +192,50 @@ class Session(ndb.Model):
     speaker = ndb.KeyProperty(kind=Speaker)
     startTime = ndb.TimeProperty(required=True)
     typeOfSession = ndb.StringProperty(repeated=True)
+    # precomputed on write so "not a workshop" is an equality filter
+    isWorkshop = ndb.ComputedProperty(
+        lambda self: 'workshop' in [t.lower() for t in self.typeOfSession])
+
+
+class Registration(ndb.Model):
+    """Registration -- Profile registered for a Conference; child of the
+    Profile keyed by websafe Conference key"""
+    conference = ndb.KeyProperty(kind=Conference)
+    created = ndb.DateTimeProperty(auto_now_add=True)
+
+
+class WishlistEntry(ndb.Model):
+    """WishlistEntry -- Session on a Profile's wishlist; child of the
+    Profile keyed by websafe Session key"""
+    session = ndb.KeyProperty(kind=Session)
+    created = ndb.DateTimeProperty(auto_now_add=True)
+
+
+class SpeakerStats(ndb.Model):
+    """SpeakerStats -- a Conference's session count per websafe Speaker
+    key, kept as sessions are added, and its featured speaker; child of
+    the Conference keyed 'speakers'"""
+    counts = ndb.JsonProperty()
+    featuredSpeaker = ndb.KeyProperty(kind=Speaker)
+    featured = ndb.StringProperty(indexed=False)
+
+
+class Agenda(ndb.Model):
+    """Agenda -- a Conference's sessions prebuilt as an encoded
+    SessionForms message; child of the Conference keyed 'agenda'"""
+    version = ndb.IntegerProperty(indexed=False)
+    data = ndb.BlobProperty(compressed=True)
+
+
+class SearchDocument(ndb.Model):
+    """SearchDocument -- inverted index entry of a Conference or Session:
+    its terms and their prefixes with the weight of each term; child of
+    the indexed entity keyed 'search'"""
+    docKind = ndb.StringProperty()
+    title = ndb.StringProperty(indexed=False)
+    terms = ndb.StringProperty(repeated=True)
+    prefixes = ndb.StringProperty(repeated=True)
+    weights = ndb.JsonProperty()
 
 
 class SessionForm(messages.Message):
@@ -162,6 +255,9 @@ class SessionForm(messages.Message):
 class SessionForms(messages.Message):
     """SessionForms -- multiple Session outbound form message"""
     items = messages.MessageField(SessionForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+    etag = messages.StringField(3)
+    notModified = messages.BooleanField(4)
 
 
 class SessionsByType(messages.Message):
@@ -174,6 +270,7 @@ class SessionsBySpeaker(messages.Message):
     """SessionBySpeaker--Conference Sessions by Speaker inbound form message"""
     firstName = messages.StringField(1)
     lastName = messages.StringField(2, required=True)
+    limit = messages.IntegerField(3)
 
 
 class AddSessionToWishlist(messages.Message):
@@ -186,6 +283,10 @@ class FindSessionByDatewithStartTimeRange(messages.Message):
     conferenceDate = messages.StringField(1, required=True)
     startTimeRangeBeginning = messages.StringField(2, required=True)
     startTimeRangeEnding = messages.StringField(3, required=True)
+    websafeConferenceKey = messages.StringField(4)
+    typeOfSession = messages.StringField(5)
+    pageSize = messages.IntegerField(6)
+    pageToken = messages.StringField(7)
 
 
 class SessionsBySpeakerOnSpecificDate(messages.Message):
@@ -193,6 +294,7 @@ class SessionsBySpeakerOnSpecificDate(messages.Message):
     firstName = messages.StringField(1)
     lastName = messages.StringField(2, required=True)
     conferenceDate = messages.StringField(3, required=True)
+    limit = messages.IntegerField(4)
 
 
 class SpeakerForm(messages.Message):
@@ -209,3 +311,67 @@ class SpeakerForm(messages.Message):
 class SpeakerForms(messages.Message):
     """SpeakerForms -- multiple Speaker outbound form message"""
     items = messages.MessageField(SpeakerForm, 1, repeated=True)
+
+
+class ImportJob(ndb.Model):
+    """ImportJob -- progress of a bulk import run a chunk per task;
+    child of the importing Profile"""
+    chunks = ndb.IntegerProperty(indexed=False)
+    records = ndb.IntegerProperty(indexed=False)
+    offset = ndb.IntegerProperty(default=0, indexed=False)  # next chunk
+    counts = ndb.JsonProperty()
+    refs = ndb.JsonProperty()               # ref -> websafe key
+    errors = ndb.JsonProperty()             # first IMPORT_MAX_ERRORS
+    failed = ndb.IntegerProperty(default=0, indexed=False)
+    done = ndb.BooleanProperty(default=False)
+    created = ndb.DateTimeProperty(auto_now_add=True)
+
+
+class ImportChunk(ndb.Model):
+    """ImportChunk -- one batch of parsed import records as JSON
+    [line number, record] pairs; child of the ImportJob keyed by
+    number"""
+    data = ndb.BlobProperty(compressed=True)
+
+
+class ExportJob(ndb.Model):
+    """ExportJob -- progress of a resumable JSONL data export"""
+    sink = ndb.StringProperty(indexed=False)
+    kinds = ndb.StringProperty(repeated=True, indexed=False)  # still to do
+    cursor = ndb.StringProperty(indexed=False)
+    page = ndb.IntegerProperty(default=0, indexed=False)
+    step = ndb.IntegerProperty(default=0, indexed=False)
+    exported = ndb.IntegerProperty(default=0, indexed=False)
+    done = ndb.BooleanProperty(default=False)
+    created = ndb.DateTimeProperty(auto_now_add=True)
+
+
+class ExportPage(ndb.Model):
+    """ExportPage -- one page of JSONL written by an ExportJob; child of
+    the job keyed by kind and page number"""
+    exportKind = ndb.StringProperty()
+    page = ndb.IntegerProperty()
+    data = ndb.BlobProperty(compressed=True)
+
+
+class SearchForm(messages.Message):
+    """SearchForm -- full-text search inbound form message"""
+    query = messages.StringField(1, required=True)
+    kind = messages.StringField(2)
+    pageSize = messages.IntegerField(3)
+    pageToken = messages.StringField(4)
+
+
+class SearchResult(messages.Message):
+    """SearchResult -- one ranked Conference or Session search match"""
+    kind = messages.StringField(1)
+    websafeKey = messages.StringField(2)
+    name = messages.StringField(3)
+    score = messages.IntegerField(4)
+
+
+class SearchResults(messages.Message):
+    """SearchResults -- one page of ranked search matches"""
+    items = messages.MessageField(SearchResult, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+    total = messages.IntegerField(3)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+
+"""
+notify.py -- Udacity conference server-side Python App Engine
+    batched outbound email: notifications are queued as compact pull
+    tasks and sent as one digest per recipient by a cron worker
+
+$Id$
+
+"""
+
+import json
+import logging
+
+from google.appengine.api import app_identity
+from google.appengine.api import mail
+from google.appengine.api import taskqueue
+
+NOTIFY_QUEUE = 'notifications'
+NOTIFY_LEASE_SECONDS = 300
+NOTIFY_LEASE_SIZE = 1000
+NOTIFY_MAX_LEASES = 10
+# notifications whose digest failed this many times are dropped
+NOTIFY_MAX_RETRIES = 5
+
+# subject for one, subject for several, intro, line format per kind
+TEMPLATES = {
+    'conferenceCreated': (
+        'You created a new Conference!',
+        'You created %d new Conferences!',
+        'Hi, you have created the following conference(s):',
+        '  * %(name)s - %(city)s, %(startDate)s to %(endDate)s'),
+}
+
+
+# - - - Transports - - - - - - - - - - - - - - - - - - - - - -
+
+class MailTransport(object):
+    """Send through the App Engine Mail API."""
+
+    def __init__(self):
+        self.sender = 'noreply@%s.appspotmail.com' % (
+            app_identity.get_application_id())
+
+    def send(self, to, subject, body):
+        mail.send_mail(self.sender, to, subject, body)
+
+
+class LocalTransport(object):
+    """Keep messages in the transport's sent list and log them instead
+    of sending; for tests and the development server."""
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, to, subject, body):
+        self.sent.append((to, subject, body))
+        logging.info('notification to %s: %s\n%s', to, subject, body)
+
+
+TRANSPORTS = {
+    'mail': MailTransport,
+    'local': LocalTransport,
+}
+
+
+# - - - Queueing - - - - - - - - - - - - - - - - - - - - - - -
+
+def notify(to, kind, data):
+    """Queue a notification of kind for recipient to; data fills in the
+    kind's line format."""
+    if kind not in TEMPLATES:
+        raise ValueError('Unknown notification kind: %s' % kind)
+    payload = json.dumps({'to': to, 'kind': kind, 'data': data},
+                         separators=(',', ':'), sort_keys=True)
+    taskqueue.Queue(NOTIFY_QUEUE).add(
+        taskqueue.Task(payload=payload, method='PULL'))
+
+
+def digest(notes):
+    """Return (subject, body) of one email covering notes, all for the
+    same recipient, grouped by kind."""
+    by_kind = {}
+    for note in notes:
+        by_kind.setdefault(note['kind'], []).append(note['data'])
+
+    subjects = []
+    sections = []
+    for kind in sorted(by_kind):
+        one, several, intro, line = TEMPLATES[kind]
+        items = by_kind[kind]
+        subjects.append(one if len(items) == 1 else several % len(items))
+        sections.append('\r\n'.join([intro, ''] +
+                                    [line % data for data in items]))
+    return ' '.join(subjects), '\r\n\r\n'.join(sections)
+
+
+# - - - Worker - - - - - - - - - - - - - - - - - - - - - - - -
+
+def sendNotifications(transport='mail'):
+    """Lease queued notifications in bulk and send one digest per
+    recipient; used by send notifications cron job. A batch's tasks are
+    deleted once its digest is sent, so a failed send is retried when
+    the lease runs out, up to NOTIFY_MAX_RETRIES times. Returns the
+    number of digests sent.
+    """
+    if transport not in TRANSPORTS:
+        raise ValueError('Unknown notification transport: %s' % transport)
+    transport = TRANSPORTS[transport]()
+    queue = taskqueue.Queue(NOTIFY_QUEUE)
+
+    sent = 0
+    for _ in range(NOTIFY_MAX_LEASES):
+        tasks = queue.lease_tasks(NOTIFY_LEASE_SECONDS, NOTIFY_LEASE_SIZE)
+        if not tasks:
+            break
+
+        done = []
+        by_recipient = {}
+        for task in tasks:
+            if task.retry_count > NOTIFY_MAX_RETRIES:
+                logging.error('dropping notification retried %d times: %r',
+                              task.retry_count, task.payload)
+                done.append(task)
+                continue
+            try:
+                note = json.loads(task.payload)
+                by_recipient.setdefault(note['to'], []).append((task, note))
+            except (ValueError, KeyError, TypeError):
+                logging.error('dropping bad notification: %r', task.payload)
+                done.append(task)
+
+        for to in sorted(by_recipient):
+            items = by_recipient[to]
+            subject, body = digest([note for task, note in items])
+            try:
+                transport.send(to, subject, body)
+            except Exception:
+                logging.exception('sending notifications to %s failed', to)
+                continue
+            done.extend(task for task, note in items)
+            sent += 1
+
+        if done:
+            queue.delete_tasks(done)
+        if len(tasks) < NOTIFY_LEASE_SIZE:
+            break
+    return sent
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+
+"""
+search.py -- Udacity conference server-side Python App Engine
+    full-text search over Conferences and Sessions: an inverted index of
+    SearchDocument entities kept up to date on writes, queried with
+    merge joins and ranked by weighted term frequency
+
+$Id$
+
+"""
+
+import hashlib
+import json
+import re
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import SearchDocument
+
+# fields indexed per kind and the weight of each occurrence of a term
+SEARCH_FIELDS = {
+    'Conference': (('name', 3), ('topics', 2), ('description', 1)),
+    'Session': (('name', 3), ('typeOfSession', 2), ('highlights', 1)),
+}
+SEARCH_STOPWORDS = frozenset([
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'in',
+    'is', 'it', 'of', 'on', 'or', 'the', 'to', 'with'])
+MIN_PREFIX_LENGTH = 2
+MAX_PREFIX_LENGTH = 12
+MAX_SEARCH_CANDIDATES = 500
+SEARCH_CACHE_SECONDS = 60
+SEARCH_BATCH_SIZE = 100
+MEMCACHE_SEARCH_KEY = "SEARCH:%s"
+
+_WORD = re.compile(r'(\w+)(\*?)', re.UNICODE)
+
+
+# - - - Indexing - - - - - - - - - - - - - - - - - - - - - - -
+
+def tokenize(text):
+    """Return the lowercase terms of text, stopwords left out."""
+    return [word for word, star in _WORD.findall((text or u'').lower())
+            if word not in SEARCH_STOPWORDS]
+
+
+def documentFor(entity):
+    """Return the SearchDocument indexing a Conference or Session; it is
+    a child of the entity so it can be written in the same transaction.
+    """
+    kind = entity._get_kind()
+    weights = {}
+    for field, weight in SEARCH_FIELDS[kind]:
+        value = getattr(entity, field)
+        values = value if isinstance(value, list) else [value]
+        for term in tokenize(u' '.join(v for v in values if v)):
+            weights[term] = weights.get(term, 0) + weight
+
+    prefixes = set()
+    for term in weights:
+        for n in range(MIN_PREFIX_LENGTH,
+                       min(len(term), MAX_PREFIX_LENGTH) + 1):
+            prefixes.add(term[:n])
+    return SearchDocument(key=ndb.Key(SearchDocument, 'search',
+                                      parent=entity.key),
+                          docKind=kind,
+                          title=entity.name,
+                          terms=sorted(weights),
+                          prefixes=sorted(prefixes),
+                          weights=weights)
+
+
+def reindex(kind, cursor=None):
+    """Index one page of entities of kind, then chain a task for the
+    next page; used by backfill search task.
+    """
+    if kind not in SEARCH_FIELDS:
+        raise ValueError('Unknown search kind: %s' % kind)
+    if cursor:
+        cursor = ndb.Cursor(urlsafe=cursor)
+    entities, next_cursor, more = ndb.Query(kind=kind).fetch_page(
+        SEARCH_BATCH_SIZE, start_cursor=cursor)
+    ndb.put_multi([documentFor(entity) for entity in entities])
+    if more and next_cursor:
+        taskqueue.add(params={'kind': kind, 'cursor': next_cursor.urlsafe()},
+                      url='/tasks/backfill_search',
+                      method='GET')
+
+
+# - - - Querying - - - - - - - - - - - - - - - - - - - - - - -
+
+def parseQuery(text):
+    """Return the (term, prefix) pairs of a query; a trailing '*' asks
+    for a prefix match ("conf*")."""
+    tokens = []
+    for word, star in _WORD.findall((text or u'').lower()):
+        if star:
+            if len(word) >= MIN_PREFIX_LENGTH:
+                tokens.append((word, True))
+        elif word not in SEARCH_STOPWORDS:
+            tokens.append((word, False))
+    return tokens
+
+
+def _score(doc, tokens):
+    """Sum the weights of the document's terms matching the query; a
+    prefix scores its best matching term. 0 if a token doesn't match."""
+    score = 0
+    for token, prefix in tokens:
+        if prefix:
+            best = max([w for term, w in doc.weights.items()
+                        if term.startswith(token)] or [0])
+        else:
+            best = doc.weights.get(token, 0)
+        if not best:
+            return 0
+        score += best
+    return score
+
+
+def search(text, kind=None):
+    """Return the documents matching every term of the query, best first,
+    as (score, kind, websafe key, title) tuples; at most
+    MAX_SEARCH_CANDIDATES documents are ranked. Rankings are cached for
+    SEARCH_CACHE_SECONDS so paging through them is cheap.
+    """
+    if kind is not None and kind not in SEARCH_FIELDS:
+        raise ValueError('Unknown search kind: %s' % kind)
+    tokens = parseQuery(text)
+    if not tokens:
+        return []
+
+    cache_key = MEMCACHE_SEARCH_KEY % hashlib.sha1(json.dumps(
+        [kind, sorted(set(tokens))]).encode('utf-8')).hexdigest()
+    ranked = memcache.get(cache_key)
+    if ranked is not None:
+        return ranked
+
+    # every filter is an equality on a single property, so the datastore
+    # answers with a merge join of built-in indexes
+    q = SearchDocument.query()
+    if kind:
+        q = q.filter(SearchDocument.docKind == kind)
+    for token, prefix in sorted(set(tokens)):
+        if prefix:
+            q = q.filter(SearchDocument.prefixes == token[:MAX_PREFIX_LENGTH])
+        else:
+            q = q.filter(SearchDocument.terms == token)
+
+    ranked = []
+    for doc in q.fetch(MAX_SEARCH_CANDIDATES):
+        score = _score(doc, tokens)
+        if score:
+            ranked.append((score, doc.docKind, doc.key.parent().urlsafe(),
+                           doc.title))
+    ranked.sort(key=lambda r: (-r[0], r[3], r[2]))
+    memcache.set(cache_key, ranked, time=SEARCH_CACHE_SECONDS)
+    return ranked
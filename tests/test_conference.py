@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+"""
+test_conference.py -- tests of the conference API against the App
+    Engine testbed service stubs
+
+Run from the app directory with the App Engine SDK (and its lib/
+protorpc, endpoints & webapp2) on PYTHONPATH:
+
+    python -m unittest discover tests
+
+"""
+
+import os
+import unittest
+
+os.environ.setdefault('APPLICATION_ID', 'dev~test')
+
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+from conference import ConferenceApi
+from models import Conference
+from models import ConferenceQueryForm
+from models import ConferenceQueryForms
+from models import Profile
+
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class ConferenceTestCase(unittest.TestCase):
+    """Activates the datastore, memcache and task queue stubs, with
+    strongly consistent queries, around each test."""
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub(
+            consistency_policy=datastore_stub_util.
+            PseudoRandomHRConsistencyPolicy(probability=1))
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub(root_path=APP_ROOT)
+        ndb.get_context().clear_cache()
+        self.api = ConferenceApi()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def makeConferences(self, *rows):
+        """Store a Conference per (name, city, month, topics) row."""
+        p_key = ndb.Key(Profile, 'organizer')
+        return ndb.put_multi([
+            Conference(parent=p_key, name=name, city=city, month=month,
+                       topics=topics, organizerUserId=p_key.id())
+            for name, city, month, topics in rows])
+
+    def queryAll(self, filters, **kwargs):
+        """Run queryConferences page by page; returns every item."""
+        items = []
+        token = None
+        while True:
+            result = self.api.queryConferences(ConferenceQueryForms(
+                filters=[ConferenceQueryForm(field=field, operator=op,
+                                             value=value)
+                         for field, op, value in filters],
+                pageToken=token, **kwargs))
+            items.extend(result.items)
+            token = result.nextPageToken
+            if not token:
+                return items
+
+
+class QueryConferencesTest(ConferenceTestCase):
+
+    def setUp(self):
+        super(QueryConferencesTest, self).setUp()
+        self.makeConferences(
+            ('Alpha', 'London', 1, ['Web']),
+            ('Bravo', 'Paris', 2, ['Web', 'Python']),
+            ('Charlie', 'London', 3, ['Python']),
+            ('Delta', 'Berlin', 4, ['Go', 'Web']),
+            ('Echo', 'London', 5, ['Python', 'Go']))
+
+    def testNotEqualPagesThroughBothHalves(self):
+        items = self.queryAll([('MONTH', 'NE', '3')], pageSize=2)
+        self.assertEqual([cf.name for cf in items],
+                         ['Alpha', 'Bravo', 'Delta', 'Echo'])
+
+    def testNotEqualOnListReturnsEachConferenceOnce(self):
+        items = self.queryAll([('TOPIC', 'NE', 'Python')], pageSize=1)
+        self.assertEqual(sorted(cf.name for cf in items),
+                         ['Alpha', 'Bravo', 'Delta', 'Echo'])
+
+    def testNotEqualWithEqualityFilter(self):
+        items = self.queryAll([('CITY', 'EQ', 'London'),
+                               ('MONTH', 'NE', '1')])
+        self.assertEqual([cf.name for cf in items], ['Charlie', 'Echo'])
+
+    def testFieldsFilteredByEqualityAreFilledIn(self):
+        items = self.queryAll([('CITY', 'EQ', 'London')],
+                              fields=['name', 'city'])
+        self.assertEqual([(cf.name, cf.city) for cf in items],
+                         [('Alpha', 'London'), ('Charlie', 'London'),
+                          ('Echo', 'London')])
+        self.assertEqual([cf.month for cf in items], [None] * 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
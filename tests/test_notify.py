@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+"""
+test_notify.py -- tests of batched notifications against the App
+    Engine testbed task queue stub, sent through LocalTransport
+
+Run from the app directory with the App Engine SDK on PYTHONPATH:
+
+    python -m unittest discover tests
+
+"""
+
+import os
+import unittest
+
+os.environ.setdefault('APPLICATION_ID', 'dev~test')
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import testbed
+
+import notify
+from notify import LocalTransport
+from notify import NOTIFY_MAX_RETRIES
+from notify import NOTIFY_QUEUE
+
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FailingTransport(LocalTransport):
+    """LocalTransport that fails to send to the recipients in failing."""
+
+    def __init__(self, failing):
+        super(FailingTransport, self).__init__()
+        self.failing = failing
+
+    def send(self, to, subject, body):
+        if to in self.failing:
+            raise IOError('cannot send to %s' % to)
+        super(FailingTransport, self).send(to, subject, body)
+
+
+class SendNotificationsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_taskqueue_stub(root_path=APP_ROOT)
+        self.taskqueue = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+        self.transport = LocalTransport()
+        notify.TRANSPORTS['test'] = lambda: self.transport
+
+    def tearDown(self):
+        del notify.TRANSPORTS['test']
+        self.testbed.deactivate()
+
+    def conferenceCreated(self, to, name):
+        notify.notify(to, 'conferenceCreated',
+                      {'name': name, 'city': 'London',
+                       'startDate': '2026-01-01', 'endDate': '2026-01-02'})
+
+    def queued(self):
+        """Return the number of tasks left on the notifications queue."""
+        return len(self.taskqueue.GetTasks(NOTIFY_QUEUE))
+
+    def testOneDigestPerRecipient(self):
+        self.conferenceCreated('ann@example.com', 'Alpha')
+        self.conferenceCreated('bob@example.com', 'Bravo')
+        self.conferenceCreated('ann@example.com', 'Charlie')
+
+        self.assertEqual(notify.sendNotifications('test'), 2)
+        self.assertEqual([(to, subject) for to, subject, body
+                          in self.transport.sent],
+                         [('ann@example.com',
+                           'You created 2 new Conferences!'),
+                          ('bob@example.com',
+                           'You created a new Conference!')])
+        ann_body = self.transport.sent[0][2]
+        self.assertTrue('Alpha - London' in ann_body)
+        self.assertTrue('Charlie - London' in ann_body)
+        self.assertFalse('Bravo' in ann_body)
+        self.assertEqual(self.queued(), 0)
+
+    def testTasksAreKeptWhenSendFails(self):
+        self.transport = FailingTransport(['bob@example.com'])
+        self.conferenceCreated('ann@example.com', 'Alpha')
+        self.conferenceCreated('bob@example.com', 'Bravo')
+
+        self.assertEqual(notify.sendNotifications('test'), 1)
+        self.assertEqual([to for to, subject, body in self.transport.sent],
+                         ['ann@example.com'])
+        # bob's task is retried once its lease runs out
+        self.assertEqual(self.queued(), 1)
+
+    def testTasksRetriedTooOftenAreDropped(self):
+        self.conferenceCreated('ann@example.com', 'Alpha')
+        queue = taskqueue.Queue(NOTIFY_QUEUE)
+        for _ in range(NOTIFY_MAX_RETRIES + 1):
+            # leases that run out at once, as if each send had failed
+            self.assertEqual(len(queue.lease_tasks(0, 10)), 1)
+        self.conferenceCreated('bob@example.com', 'Bravo')
+
+        self.assertEqual(notify.sendNotifications('test'), 1)
+        self.assertEqual([to for to, subject, body in self.transport.sent],
+                         ['bob@example.com'])
+        self.assertEqual(self.queued(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
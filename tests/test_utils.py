@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+"""
+test_utils.py -- tests of the tokeninfo cache against the App Engine
+    testbed memcache stub, with a stub tokeninfo fetcher
+
+Run from the app directory with the App Engine SDK on PYTHONPATH:
+
+    python -m unittest discover tests
+
+"""
+
+import hashlib
+import os
+import threading
+import time
+import unittest
+
+os.environ.setdefault('APPLICATION_ID', 'dev~test')
+
+from google.appengine.api import memcache
+from google.appengine.ext import testbed
+
+import utils
+from utils import MEMCACHE_TOKEN_KEY
+from utils import TOKEN_CACHE_TIME
+from utils import TokenInfoCache
+
+
+class StubFetcher(object):
+    """Answers tokeninfo lookups with info, counting them; the first
+    lookup waits for release() when blocking."""
+
+    def __init__(self, info, blocking=False):
+        self.info = info
+        self.calls = 0
+        self.entered = threading.Event()
+        self.released = threading.Event()
+        if not blocking:
+            self.released.set()
+
+    def release(self):
+        self.released.set()
+
+    def __call__(self, token, token_type):
+        self.calls += 1
+        if self.calls == 1:
+            self.entered.set()
+            self.released.wait(5)
+        return dict(self.info)
+
+
+class TokenInfoCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_memcache_stub()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def cached(self, token):
+        """Return the memcache entry of token, or None."""
+        key = hashlib.sha1(token).hexdigest()
+        return memcache.get(MEMCACHE_TOKEN_KEY % key)
+
+    def inThread(self, cache, token, results):
+        """Start a thread appending the user id of token to results."""
+        thread = threading.Thread(
+            target=lambda: results.append(cache.userId(token)))
+        thread.start()
+        return thread
+
+    def testCachesUserIdUntilTokenExpires(self):
+        fetcher = StubFetcher({'user_id': '42', 'expires_in': 600})
+        cache = TokenInfoCache(fetcher=fetcher)
+        self.assertEqual(cache.userId('token'), '42')
+        self.assertEqual(cache.userId('token'), '42')
+        self.assertEqual(fetcher.calls, 1)
+
+        user_id, expires = self.cached('token')
+        self.assertEqual(user_id, '42')
+        self.assertAlmostEqual(expires, time.time() + 600, delta=5)
+
+        # another instance finds it in memcache
+        other = StubFetcher({'user_id': '42', 'expires_in': 600})
+        self.assertEqual(TokenInfoCache(fetcher=other).userId('token'), '42')
+        self.assertEqual(other.calls, 0)
+
+    def testTtlIsCappedAtTokenCacheTime(self):
+        fetcher = StubFetcher({'user_id': '42',
+                               'expires_in': TOKEN_CACHE_TIME * 2})
+        TokenInfoCache(fetcher=fetcher).userId('token')
+        user_id, expires = self.cached('token')
+        self.assertTrue(expires <= time.time() + TOKEN_CACHE_TIME)
+        self.assertAlmostEqual(expires, time.time() + TOKEN_CACHE_TIME,
+                               delta=5)
+
+    def testFailedLookupIsNotCached(self):
+        fetcher = StubFetcher({})
+        cache = TokenInfoCache(fetcher=fetcher)
+        self.assertEqual(cache.userId('token'), '')
+        self.assertEqual(cache.userId('token'), '')
+        self.assertEqual(fetcher.calls, 2)
+        self.assertEqual(self.cached('token'), None)
+
+    def testExpiredTokenIsNotCached(self):
+        fetcher = StubFetcher({'user_id': '42', 'expires_in': 0})
+        cache = TokenInfoCache(fetcher=fetcher)
+        self.assertEqual(cache.userId('token'), '42')
+        self.assertEqual(cache.userId('token'), '42')
+        self.assertEqual(fetcher.calls, 2)
+        self.assertEqual(self.cached('token'), None)
+
+    def testConcurrentLookupsShareOneFetch(self):
+        fetcher = StubFetcher({'user_id': '42', 'expires_in': 600},
+                              blocking=True)
+        cache = TokenInfoCache(fetcher=fetcher)
+        results = []
+        leader = self.inThread(cache, 'token', results)
+        self.assertTrue(fetcher.entered.wait(5))
+        followers = [self.inThread(cache, 'token', results)
+                     for _ in range(3)]
+        fetcher.release()
+        for thread in [leader] + followers:
+            thread.join(5)
+        self.assertEqual(results, ['42'] * 4)
+        self.assertEqual(fetcher.calls, 1)
+
+    def testWaiterLooksUpItselfAfterTimeout(self):
+        fetcher = StubFetcher({'user_id': '42', 'expires_in': 600},
+                              blocking=True)
+        cache = TokenInfoCache(fetcher=fetcher)
+        results = []
+        leader = self.inThread(cache, 'token', results)
+        self.assertTrue(fetcher.entered.wait(5))
+
+        timeout = utils.TOKEN_FLIGHT_TIMEOUT
+        utils.TOKEN_FLIGHT_TIMEOUT = 0.1
+        try:
+            # the leader is still stuck, so this gives up waiting for it
+            self.assertEqual(cache.userId('token'), '42')
+        finally:
+            utils.TOKEN_FLIGHT_TIMEOUT = timeout
+        self.assertEqual(fetcher.calls, 2)
+
+        fetcher.release()
+        leader.join(5)
+        self.assertEqual(results, ['42'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+
+"""
+bench_serializers.py -- micro-benchmark of the _copy*ToForm entity to
+    message serializers, reflection-based (before) vs field copy plans
+
+Run from the app directory with the App Engine SDK (and its lib/
+protorpc, endpoints & webapp2) on PYTHONPATH:
+
+    python tools/bench_serializers.py [rows]
+
+"""
+
+from datetime import date
+from datetime import time
+import os
+import sys
+import timeit
+
+os.environ.setdefault('APPLICATION_ID', 'dev~bench')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google.appengine.ext import ndb
+
+from conference import ConferenceApi
+from models import Conference
+from models import ConferenceForm
+from models import Profile
+from models import ProfileForm
+from models import Session
+from models import SessionForm
+from models import Speaker
+from models import SpeakerForm
+from models import TeeShirtSize
+
+
+# - - - reflection copies, as they were before field copy plans - - -
+
+def conferenceBefore(conf):
+    cf = ConferenceForm()
+    for field in cf.all_fields():
+        if hasattr(conf, field.name):
+            if field.name.endswith('Date'):
+                setattr(cf, field.name, str(getattr(conf, field.name)))
+            else:
+                setattr(cf, field.name, getattr(conf, field.name))
+        elif field.name == "websafeKey":
+            setattr(cf, field.name, conf.key.urlsafe())
+    cf.check_initialized()
+    return cf
+
+
+def sessionBefore(sess):
+    sf = SessionForm()
+    for field in sf.all_fields():
+        if hasattr(sess, field.name):
+            if field.name.endswith('date'):
+                setattr(sf, field.name, str(getattr(sess, field.name)))
+            elif field.name.endswith('Time'):
+                setattr(sf, field.name,
+                        str(getattr(sess, field.name).strftime("%H:%M")))
+            else:
+                setattr(sf, field.name, getattr(sess, field.name))
+        elif field.name == "sessionWebSafeKey":
+            setattr(sf, field.name, sess.key.urlsafe())
+        # speakerName lookups are an RPC, not serialization; left out
+    sf.check_initialized()
+    return sf
+
+
+def profileBefore(prof):
+    pf = ProfileForm()
+    for field in pf.all_fields():
+        if hasattr(prof, field.name):
+            if field.name == 'teeShirtSize':
+                setattr(pf, field.name, getattr(
+                        TeeShirtSize, getattr(prof, field.name)))
+            else:
+                setattr(pf, field.name, getattr(prof, field.name))
+    pf.check_initialized()
+    return pf
+
+
+def speakerBefore(speak):
+    sp = SpeakerForm()
+    for field in sp.all_fields():
+        if hasattr(speak, field.name):
+            setattr(sp, field.name, getattr(speak, field.name))
+        elif field.name == "speakerWebSafeKey":
+            setattr(sp, field.name, speak.key.urlsafe())
+    sp.check_initialized()
+    return sp
+
+
+# - - - in-memory entities - - - - - - - - - - - - - - - - - -
+
+def makeEntities(rows):
+    p_key = ndb.Key(Profile, 'bench@example.com')
+    c_key = ndb.Key(Conference, 1, parent=p_key)
+    confs = [Conference(key=ndb.Key(Conference, i + 1, parent=p_key),
+                        name='Conference %d' % i,
+                        description='A conference about things ' * 8,
+                        organizerUserId=p_key.id(),
+                        organizerDisplayName='Bench',
+                        topics=['Web', 'Programming Languages'],
+                        city='London', startDate=date(2016, 6, 1),
+                        month=6, endDate=date(2016, 6, 3),
+                        maxAttendees=100, seatsAvailable=42)
+             for i in range(rows)]
+    sessions = [Session(key=ndb.Key(Session, i + 1, parent=c_key),
+                        name='Session %d' % i, date=date(2016, 6, 1),
+                        startTime=time(10, 30), duration=60,
+                        highlights='Highlights ' * 8,
+                        typeOfSession=['Lecture'])
+                for i in range(rows)]
+    profiles = [Profile(key=ndb.Key(Profile, 'user%d@example.com' % i),
+                        displayName='User %d' % i,
+                        mainEmail='user%d@example.com' % i,
+                        teeShirtSize='M_M')
+                for i in range(rows)]
+    speakers = [Speaker(key=ndb.Key(Speaker, i + 1, parent=p_key),
+                        firstName='Ada', lastName='Lovelace %d' % i,
+                        email='ada@example.com', companyName='Engines')
+                for i in range(rows)]
+    return confs, sessions, profiles, speakers
+
+
+def bench(name, before, after, entities, repeat=3):
+    t_before = min(timeit.repeat(lambda: [before(e) for e in entities],
+                                 number=1, repeat=repeat))
+    t_after = min(timeit.repeat(lambda: [after(e) for e in entities],
+                                number=1, repeat=repeat))
+    rows = len(entities)
+    print('%-12s %12.0f rows/s %12.0f rows/s %8.2fx' % (
+        name, rows / t_before, rows / t_after, t_before / t_after))
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    api = ConferenceApi()
+    confs, sessions, profiles, speakers = makeEntities(rows)
+
+    print('%d rows per list' % rows)
+    print('%-12s %19s %19s %9s' % ('serializer', 'before', 'after',
+                                   'speedup'))
+    bench('Conference', conferenceBefore, api._copyConferenceToForm, confs)
+    bench('Session', sessionBefore,
+          lambda sess: api._copySessionToForm(sess, {}), sessions)
+    bench('Profile', profileBefore,
+          lambda prof: api._copyProfileToForm(prof, [], []), profiles)
+    bench('Speaker', speakerBefore, api._copySpeakerToForm, speakers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+"""
+unitofwork.py -- request-scoped unit of work for datastore writes
+
+Endpoint methods wrapped with perRequest() collect the entities they
+change with put() and write them with one put_multi when the method
+returns. Entities that haven't changed since they were loaded (see
+track()) or since they were last written are skipped. Outside a unit
+of work, and inside transactions, put() writes straight away.
+
+"""
+
+import functools
+import threading
+
+from google.appengine.ext import ndb
+
+_local = threading.local()
+
+
+class UnitOfWork(object):
+    """Entities written by one request, flushed together."""
+
+    def __init__(self):
+        self._snapshots = {}
+        self._pending = []
+        self._entities = {}
+        self._callbacks = []
+
+    @staticmethod
+    def _snapshot(entity):
+        return entity._to_pb().SerializeToString()
+
+    def track(self, entity):
+        """Remember entity as loaded so writing it back unchanged is
+        skipped."""
+        if entity is not None:
+            self._snapshots[entity.key] = self._snapshot(entity)
+        return entity
+
+    def put(self, entity):
+        """Queue entity to be written when the unit of work flushes."""
+        if entity.key not in self._entities:
+            self._pending.append(entity.key)
+        self._entities[entity.key] = entity
+
+    def afterFlush(self, callback):
+        """Run callback once the queued writes are done."""
+        self._callbacks.append(callback)
+
+    def flush(self):
+        """Write the changed entities with one put_multi, then run the
+        after flush callbacks; returns the entities written."""
+        dirty = []
+        for key in self._pending:
+            entity = self._entities[key]
+            snapshot = self._snapshot(entity)
+            if self._snapshots.get(key) != snapshot:
+                dirty.append(entity)
+                self._snapshots[key] = snapshot
+        self._pending = []
+        self._entities = {}
+        if dirty:
+            ndb.put_multi(dirty)
+
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+        return dirty
+
+
+def current():
+    """Return the unit of work of the running request, if any."""
+    return getattr(_local, 'work', None)
+
+
+def track(entity):
+    """Track a loaded entity in the current unit of work; returns it."""
+    work = current()
+    if work is not None:
+        work.track(entity)
+    return entity
+
+
+def put(entity):
+    """Write entity with the current unit of work, or now without one."""
+    work = current()
+    if work is None or ndb.in_transaction():
+        entity.put()
+    else:
+        work.put(entity)
+
+
+def afterFlush(callback):
+    """Run callback after the current unit of work's writes, or now
+    without one."""
+    work = current()
+    if work is None:
+        callback()
+    else:
+        work.afterFlush(callback)
+
+
+def perRequest(method):
+    """Decorator running an endpoint method in a unit of work that is
+    flushed when it returns; nothing is written if it raises."""
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        if current() is not None:
+            return method(*args, **kwargs)
+        _local.work = UnitOfWork()
+        try:
+            result = method(*args, **kwargs)
+            _local.work.flush()
+            return result
+        finally:
+            _local.work = None
+    return wrapper
@@ -1,10 +1,161 @@
+from collections import OrderedDict
+import hashlib
 import json
 import os
+import threading
 import time
 import uuid
 
+from google.appengine.api import memcache
 from google.appengine.api import urlfetch
-from models import Profile
+from google.appengine.ext import ndb
+from models import UserEmail
+
+MEMCACHE_TOKEN_KEY = "TOKENINFO:%s"
+# user ids are cached until the token expires, but never longer than this
+TOKEN_CACHE_TIME = 3600
+TOKEN_CACHE_SIZE = 1000
+# how long a request waits for another one looking up the same token
+TOKEN_FLIGHT_TIMEOUT = 10
+EMAIL_CACHE_SIZE = 10000
+
+
+def fetchTokenInfo(token, token_type='id_token'):
+    """Ask the tokeninfo endpoint about token, retrying as an access
+    token if it isn't a valid id token; returns the tokeninfo dict."""
+    url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
+           % (token_type, token))
+    info = {}
+    wait = 1
+    for i in range(3):
+        resp = urlfetch.fetch(url)
+        if resp.status_code == 200:
+            info = json.loads(resp.content)
+            break
+        elif resp.status_code == 400 and 'invalid_token' in resp.content:
+            url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
+                   % ('access_token', token))
+        else:
+            time.sleep(wait)
+            wait = wait + i
+    return info
+
+
+class LRUCache(object):
+    """A thread-safe dict of at most size entries, dropping the least
+    recently used."""
+
+    def __init__(self, size):
+        self._size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.pop(key, None)
+            if value is not None:
+                # keep it as the most recently used
+                self._entries[key] = value
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            while len(self._entries) > self._size:
+                self._entries.popitem(last=False)
+
+
+class _Flight(object):
+    """A tokeninfo lookup in progress, shared by concurrent requests."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.userId = None
+
+
+class TokenInfoCache(object):
+    """token -> user id, cached in process (LRU) and in memcache until
+    the token expires, with one lookup per token at a time; fetcher is
+    called as fetcher(token, token_type) and returns tokeninfo."""
+
+    def __init__(self, fetcher=fetchTokenInfo, size=TOKEN_CACHE_SIZE):
+        self._fetcher = fetcher
+        self._entries = LRUCache(size)
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def _recall(self, key):
+        entry = self._entries.get(key)
+        if entry and entry[1] > time.time():
+            return entry[0]
+        return None
+
+    def _remember(self, key, user_id, expires):
+        self._entries.set(key, (user_id, expires))
+
+    def _lookup(self, key, token, token_type):
+        cached = memcache.get(MEMCACHE_TOKEN_KEY % key)
+        if cached and cached[1] > time.time():
+            self._remember(key, *cached)
+            return cached[0]
+
+        info = self._fetcher(token, token_type)
+        user_id = info.get('user_id', '')
+        ttl = min(int(info.get('expires_in', 0)), TOKEN_CACHE_TIME)
+        # failed lookups are not cached
+        if user_id and ttl > 0:
+            expires = time.time() + ttl
+            memcache.set(MEMCACHE_TOKEN_KEY % key, (user_id, expires),
+                         time=ttl)
+            self._remember(key, user_id, expires)
+        return user_id
+
+    def userId(self, token, token_type='id_token'):
+        """Return the user id token belongs to, or '' if it's invalid."""
+        key = hashlib.sha1(token).hexdigest()
+        user_id = self._recall(key)
+        if user_id:
+            return user_id
+
+        # single flight: the first request looks the token up, the
+        # others wait for its answer
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            if flight.done.wait(TOKEN_FLIGHT_TIMEOUT):
+                return flight.userId or ''
+            return self._lookup(key, token, token_type)
+
+        try:
+            flight.userId = self._lookup(key, token, token_type)
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.userId
+
+
+# shared by the requests an instance serves
+tokenInfoCache = TokenInfoCache()
+# email -> user id; mappings never change once made
+emailUserIds = LRUCache(EMAIL_CACHE_SIZE)
+
+
+def emailUserId(email):
+    """Return the user id mapped to email by its UserEmail, or a new id
+    if there is none yet (it is mapped when the Profile is created)."""
+    user_id = emailUserIds.get(email)
+    if user_id:
+        return user_id
+    mapping = ndb.Key(UserEmail, email).get()
+    if not mapping:
+        return str(uuid.uuid1().get_hex())
+    emailUserIds.set(email, mapping.userId)
+    return mapping.userId
 
 
 def getUserId(user, id_type="email"):
@@ -18,29 +169,10 @@ def getUserId(user, id_type="email"):
         token_type = 'id_token'
         if 'OAUTH_USER_ID' in os.environ:
             token_type = 'access_token'
-        url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-               % (token_type, token))
-        user = {}
-        wait = 1
-        for i in range(3):
-            resp = urlfetch.fetch(url)
-            if resp.status_code == 200:
-                user = json.loads(resp.content)
-                break
-            elif resp.status_code == 400 and 'invalid_token' in resp.content:
-                url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-                       % ('access_token', token))
-            else:
-                time.sleep(wait)
-                wait = wait + i
-        return user.get('user_id', '')
+        return tokenInfoCache.userId(token, token_type)
 
     if id_type == "custom":
         # implement your own user_id creation and getting algorythm
-        # this is just a sample that queries datastore for an existing profile
+        # this is just a sample that looks up the id mapped to an email
         # and generates an id if profile does not exist for an email
-        profile = Conference.query(Conference.mainEmail == user.email())
-        if profile:
-            return profile.id()
-        else:
-            return str(uuid.uuid1().get_hex())
+        return emailUserId(user.email())